@@ -0,0 +1,65 @@
+import numpy
+
+# ----------------------------------------------------------------------------------------
+def split_at_midnight(starts, ends):
+    """
+    Split each interval [starts[i], ends[i]) (datetime64 arrays) into one piece for each day that it overlaps.
+    Returns (index of the interval each piece came from, date of each piece, hours in each piece, hours in the whole interval).
+    An interval of zero length gets a single zero-length piece on its start date.
+    """
+    starts, ends = starts.astype('datetime64[s]'), ends.astype('datetime64[s]')
+    first_days = starts.astype('datetime64[D]')
+    last_days = numpy.maximum((ends - numpy.timedelta64(1, 's')).astype('datetime64[D]'), first_days)  # an interval ending exactly at midnight doesn't get a piece in the next day
+    n_days = (last_days - first_days).astype(int) + 1
+
+    ipieces = numpy.repeat(numpy.arange(len(starts)), n_days)
+    day_offsets = numpy.arange(len(ipieces)) - numpy.repeat(numpy.cumsum(n_days) - n_days, n_days)
+    piece_days = first_days[ipieces] + day_offsets
+    piece_starts = numpy.maximum(starts[ipieces], piece_days.astype('datetime64[s]'))
+    piece_ends = numpy.minimum(ends[ipieces], (piece_days + 1).astype('datetime64[s]'))
+    one_hour = numpy.timedelta64(1, 'h')
+    return ipieces, piece_days, (piece_ends - piece_starts) / one_hour, (ends - starts)[ipieces] / one_hour
+
+# ----------------------------------------------------------------------------------------
+def aggregate_days(series):
+    """
+    Combine the values within each day for every series in <series> at once, returning (dates, table), where <dates> is a sorted datetime64[D] array of every date with any values, and <table> is name : float array aligned with <dates> (nan where a series has nothing for that date).
+    Each entry in <series> is (name, action, starts, ends, values), where <starts> and <ends> are datetime64 arrays, <values> is a float array (nan for missing values, which are skipped), and <action> is either:
+      'sum':  intervals spanning midnight are apportioned between the days by the number of hours in each (e.g. precip amounts)
+      'mean': average weighted by the number of hours of each interval within the day (e.g. wind speed)
+    """
+    iseries, all_days, contributions, weights = [], [], [], []
+    for iname, (name, action, starts, ends, values) in enumerate(series):
+        assert action == 'sum' or action == 'mean'
+        values = numpy.asarray(values, dtype=float)
+        present = ~numpy.isnan(values)
+        ipieces, piece_days, piece_hours, total_hours = split_at_midnight(starts[present], ends[present])
+        piece_values = values[present][ipieces]
+        if action == 'sum':
+            fractions = numpy.where(total_hours > 0, piece_hours / numpy.where(total_hours > 0, total_hours, 1), 1.)
+            contributions.append(piece_values * fractions)
+            weights.append(numpy.ones(len(ipieces)))  # just so every day with a piece gets a value, even if it's zero
+        else:
+            contributions.append(piece_values * piece_hours)
+            weights.append(piece_hours)
+        iseries.append(numpy.full(len(ipieces), iname, dtype=int))
+        all_days.append(piece_days)
+
+    if len(series) == 0 or sum(len(days) for days in all_days) == 0:
+        return numpy.array([], dtype='datetime64[D]'), {name : numpy.array([]) for name, _, _, _, _ in series}
+
+    all_days = numpy.concatenate(all_days)
+    dates = numpy.unique(all_days)
+    index = (numpy.concatenate(iseries), numpy.searchsorted(dates, all_days))
+    totals = numpy.zeros((len(series), len(dates)))
+    weight_sums = numpy.zeros((len(series), len(dates)))
+    numpy.add.at(totals, index, numpy.concatenate(contributions))
+    numpy.add.at(weight_sums, index, numpy.concatenate(weights))
+
+    table = {}
+    for iname, (name, action, _, _, _) in enumerate(series):
+        if action == 'sum':
+            table[name] = numpy.where(weight_sums[iname] > 0, totals[iname], numpy.nan)
+        else:
+            table[name] = numpy.where(weight_sums[iname] > 0, totals[iname] / numpy.where(weight_sums[iname] > 0, weight_sums[iname], 1), numpy.nan)
+    return dates, table
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# run scrape.py and wrfparser end to end against replayserver.py, and report the wall time of each stage
+# e.g. ./benchmark.py --latency 0.3 --jitter 0.2 --scrape-args='--ndfd-batch-size 0'
+import os
+import sys
+import time
+import shlex
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+import replayserver
+
+repodir = replayserver.repodir
+
+# ----------------------------------------------------------------------------------------
+def run_stage(name, cmd, server, logfname):
+    """ run <cmd>, returning (name, wall time, number of requests it made, exit status) """
+    n_before = server.n_requests
+    start = time.time()
+    with open(logfname, 'w') as logfile:
+        retval = subprocess.call(cmd, cwd=repodir, stdout=logfile, stderr=subprocess.STDOUT)
+    return name, time.time() - start, server.n_requests - n_before, retval
+
+# ----------------------------------------------------------------------------------------
+parser = argparse.ArgumentParser()
+parser.add_argument('--workdir', help='where to put output, cache, and logs (default: a temp dir that gets removed at the end)')
+parser.add_argument('--python2', default='python2', help='interpreter for scrape.py')
+parser.add_argument('--python3', default=sys.executable, help='interpreter for wrfparser')
+parser.add_argument('--latency', type=float, default=0.2, help='see replayserver.py')
+parser.add_argument('--jitter', type=float, default=0.)
+parser.add_argument('--error-rate', type=float, default=0.)
+parser.add_argument('--error-code', type=int, default=503)
+parser.add_argument('--wrf-progress', type=int)
+parser.add_argument('--noaa-location-fname', default=repodir + '/locations/noaa.csv')
+parser.add_argument('--mtwx-location-fname', default=repodir + '/locations/mtwx.csv')
+parser.add_argument('--wrf-config-fname', default=repodir + '/wrfparser/config.csv')
+parser.add_argument('--scrape-args', default='', help='extra args for scrape.py')
+parser.add_argument('--wrf-args', default='', help='extra args for wrfparser')
+parser.add_argument('--no-scrape', action='store_true')
+parser.add_argument('--no-wrf', action='store_true')
+args = parser.parse_args()
+
+workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp()
+if not os.path.exists(workdir):
+    os.makedirs(workdir)
+
+server = replayserver.ReplayServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, error_code=args.error_code, wrf_progress=args.wrf_progress)
+server.start()
+print('replaying at %s, writing to %s' % (server.url, workdir))
+
+stages = []
+if not args.no_scrape:
+    scrape_cmd = [args.python2, repodir + '/scrape.py', '--replay-url', server.url, '--outfname', workdir + '/html/weather.html', '--cachedir', workdir + '/_cache', '--history-dir', workdir + '/_history',
+                  '--noaa-location-fname', args.noaa_location_fname, '--mtwx-location-fname', args.mtwx_location_fname] + shlex.split(args.scrape_args)
+    stages.append(('scrape (cold cache)', scrape_cmd))
+    stages.append(('scrape (revalidate)', scrape_cmd + ['--mtwx-cache-ttl', '0', '--noaa-cache-ttl', '0']))  # everything comes back 304
+    stages.append(('scrape (cache only)', scrape_cmd + ['--use-cache']))
+if not args.no_wrf:
+    wrf_cmd = [args.python3, repodir + '/wrfparser/wrfparser.py', '--replay-url', server.url, '--outdir', workdir + '/wrfparser', '--config-fname', args.wrf_config_fname, '--no-sleep', '--no-push'] + shlex.split(args.wrf_args)
+    stages.append(('wrfparser (cold)', wrf_cmd))
+    stages.append(('wrfparser (warm)', wrf_cmd))  # same run, so nothing to download
+
+results = []
+for istage, (name, cmd) in enumerate(stages):
+    print('  %s' % name)
+    results.append(run_stage(name, cmd, server, '%s/stage-%d.log' % (workdir, istage)))
+
+print('%22s  %8s  %8s  %s' % ('stage', 'time (s)', 'requests', 'exit status'))
+for name, wall_time, n_requests, retval in results:
+    print('%22s  %8.2f  %8d  %d' % (name, wall_time, n_requests, retval))
+
+server.shutdown()
+if any(retval != 0 for _, _, _, retval in results):
+    print('see %s/stage-*.log for output' % workdir)
+elif args.workdir is None:
+    shutil.rmtree(workdir)
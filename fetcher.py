@@ -0,0 +1,74 @@
+import threading
+import Queue
+
+import httpclient
+import httpcache
+
+default_max_connections = 4  # per host
+
+# ----------------------------------------------------------------------------------------
+def fetch_url(url, timeout=httpclient.default_timeout):
+    resp = httpclient.get(url, timeout=timeout)
+    resp.raise_for_status()
+    return resp.content
+
+# ----------------------------------------------------------------------------------------
+def fetch_job(job, timeout=httpclient.default_timeout):
+    """ return (payload, status) for <job>, going through the http cache if it has a 'cachefname' (status is None if it doesn't) """
+    if job.get('cachefname') is None:
+        return fetch_url(job['url'], timeout=timeout), None
+    return httpcache.fetch(job['url'], job['cachefname'], ttl=job.get('ttl'), timeout=timeout)
+
+# ----------------------------------------------------------------------------------------
+def fetch_all(jobs, max_connections=None, timeout=httpclient.default_timeout):
+    """
+    Download each job in <jobs> (a dict with 'key', 'url', and optionally 'cachefname' and 'ttl'), yielding (key, payload, status, error) as each one finishes (i.e. *not* in the order of <jobs>).
+    Each host gets its own set of worker threads, the number of which is taken from <max_connections> (a dict keyed by host), so a slow host doesn't hold up the others.
+    Parsing/plotting should happen in the calling thread as results are yielded (matplotlib isn't thread safe).
+    """
+    if max_connections is None:
+        max_connections = {}
+
+    host_queues = {}
+    for job in jobs:
+        host = httpclient.get_host(job['url'])
+        if host not in host_queues:
+            host_queues[host] = Queue.Queue()
+        host_queues[host].put(job)
+
+    results = Queue.Queue()
+
+    # ----------------------------------------------------------------------------------------
+    def work(jobqueue):
+        while True:
+            try:
+                job = jobqueue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                payload, status = fetch_job(job, timeout=timeout)
+                results.put((job['key'], payload, status, None))
+            except Exception as e:  # pass it back to the caller to decide what to do
+                results.put((job['key'], None, None, e))
+
+    pool_sizes = {}  # host we actually connect to (with --replay-url, everything goes to the replay server) : total connections
+    for host, jobqueue in host_queues.items():
+        actual_host = httpclient.get_host(httpclient.rewrite_url(jobqueue.queue[0]['url']))
+        pool_sizes[actual_host] = pool_sizes.get(actual_host, 0) + max_connections.get(host, default_max_connections)
+    for actual_host, pool_size in pool_sizes.items():
+        httpclient.set_pool_size(actual_host, pool_size)  # keep them all alive for the whole run
+
+    threads = []
+    for host, jobqueue in host_queues.items():
+        n_connections = max_connections.get(host, default_max_connections)
+        for _ in range(min(n_connections, jobqueue.qsize())):
+            thread = threading.Thread(target=work, args=(jobqueue, ))
+            thread.daemon = True  # don't hang on ctrl-c
+            thread.start()
+            threads.append(thread)
+
+    for _ in range(len(jobs)):
+        yield results.get()
+
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# consolidate the history for every location (from the csvs, or from the sqlite file if you give it --history-db) into one directory of numpy columns, which load() memory maps, so scanning years of history across all the locations doesn't mean parsing a pile of csvs first
+#   ./historyarchive.py build --history-dir _history --archive-dir _history-archive
+#   ./historyarchive.py season-totals --archive-dir _history-archive --var snow
+import os
+import shutil
+import argparse
+import numpy
+
+import historylog
+import historydb
+
+sources = sorted(historydb.source_vars)
+archive_vars = ['hi', 'lo', 'rain', 'snow', 'wind-speed', 'wind-direction']
+archive_units = {'hi' : 'F', 'lo' : 'F', 'rain' : 'in', 'snow' : 'in', 'wind-speed' : 'mph', 'wind-direction' : 'degrees'}  # same for every source (see <source_scales>)
+source_columns = {'mtwx' : {'hi' : 'high', 'lo' : 'low', 'rain' : 'rain', 'snow' : 'snow', 'wind-speed' : 'wind-speed', 'wind-direction' : 'wind-direction'},  # archive var : history file column for each source
+                  'noaa' : {'hi' : 'hi', 'lo' : 'lo', 'rain' : 'liquid', 'snow' : 'snow', 'wind-speed' : 'wind'}}  # (noaa doesn't have wind direction)
+source_scales = {'mtwx' : {'snow' : 12.}}  # archive var : factor to get from the history file's units to <archive_units> (mtwx snow is in feet, noaa's in inches)
+column_dtypes = [('date', 'datetime64[D]'), ('location', 'i4'), ('source', 'i1'), ('time-of-day', 'i1')] + [(var, 'f8') for var in archive_vars]  # one .npy file for each of these, one entry per row (time-of-day is the index in utils.times_of_day, or -1 for daily rows)
+
+# ----------------------------------------------------------------------------------------
+def to_float(value):
+    return float(value) if value not in ('', None) else numpy.nan
+
+# ----------------------------------------------------------------------------------------
+def read_location(fname, source):
+    """ columns (as a dict of arrays) for the latest row for each date (and time of day) in history file <fname>, sorted by date """
+    rows = historylog.latest_rows(historydb.read_rows(fname), historylog.get_key_fields(historydb.get_header(source))).values()
+    dates, tods = zip(*[historylog.get_sort_key(row) for row in rows]) if len(rows) > 0 else ([], [])
+    isorted = sorted(range(len(rows)), key=lambda irow: (dates[irow], tods[irow]))
+    columns = {'date' : numpy.array([dates[irow] for irow in isorted], dtype='datetime64[D]'),
+               'time-of-day' : numpy.array([tods[irow] for irow in isorted], dtype='i1')}
+    for var in archive_vars:
+        column = source_columns[source].get(var)
+        columns[var] = source_scales.get(source, {}).get(var, 1.) * numpy.array([to_float(rows[irow][column]) if column is not None else numpy.nan for irow in isorted])
+    return columns
+
+# ----------------------------------------------------------------------------------------
+def build(history_dir, archive_dir):
+    """ (re)write the archive in <archive_dir> from all the history in <history_dir> (or the database, if historydb.dbfname is set) """
+    location_names, location_sources, all_columns = [], [], []
+    for isource, source in enumerate(sources):
+        for fname in historydb.list_fnames(history_dir, source):
+            columns = read_location(fname, source)
+            columns['location'] = numpy.full(len(columns['date']), len(location_names), dtype='i4')
+            columns['source'] = numpy.full(len(columns['date']), isource, dtype='i1')
+            location_names.append(historydb.get_source_and_location(fname)[1])
+            location_sources.append(isource)
+            all_columns.append(columns)
+
+    tmpdir = archive_dir + '.part'  # write it all somewhere else, then swap it in, so readers never see half an archive
+    if os.path.exists(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    for name, dtype in column_dtypes:
+        numpy.save(tmpdir + '/' + name + '.npy', numpy.concatenate([columns[name] for columns in all_columns]) if len(all_columns) > 0 else numpy.array([], dtype=dtype))
+    numpy.save(tmpdir + '/location-names.npy', numpy.array(location_names, dtype=str))
+    numpy.save(tmpdir + '/location-sources.npy', numpy.array(location_sources, dtype='i1'))
+    numpy.save(tmpdir + '/sources.npy', numpy.array(sources, dtype=str))
+    if os.path.exists(archive_dir):
+        os.rename(archive_dir, archive_dir + '.old')
+    os.rename(tmpdir, archive_dir)
+    if os.path.exists(archive_dir + '.old'):
+        shutil.rmtree(archive_dir + '.old')
+    return sum(len(columns['date']) for columns in all_columns), len(location_names)
+
+# ----------------------------------------------------------------------------------------
+def load(archive_dir):
+    """
+    Dict of column name : array for the archive in <archive_dir>, where the big columns are memory mapped (so loading is nearly free, and a scan only reads the columns it uses).
+    Also has the (small, not mapped) per-location arrays 'location-names' and 'location-sources' (indexed by the 'location' column), and 'sources' (indexed by the 'source' column).
+    """
+    archive = {name : numpy.load(archive_dir + '/' + name + '.npy', mmap_mode='r') for name, _ in column_dtypes}
+    for name in ['location-names', 'location-sources', 'sources']:
+        archive[name] = numpy.load(archive_dir + '/' + name + '.npy')
+    return archive
+
+# ----------------------------------------------------------------------------------------
+def get_season_totals(archive, var='snow', season_start_month=10):
+    """
+    Sum <var> over each season (starting on the first of <season_start_month>, and labeled by the year in which it starts) for each location.
+    Returns (seasons, totals), where <totals> has shape (number of locations, number of seasons), and is nan where a location has no values for a season.
+    """
+    n_locations = len(archive['location-names'])
+    if len(archive['date']) == 0:
+        return numpy.array([], dtype=int), numpy.zeros((n_locations, 0))
+    months = archive['date'].astype('datetime64[M]').astype(int)  # since January 1970
+    seasons = (months - (season_start_month - 1)) // 12 + 1970
+    first_season, n_seasons = seasons.min(), seasons.max() - seasons.min() + 1
+    values = numpy.asarray(archive[var])
+    present = ~numpy.isnan(values)
+    bins = archive['location'][present] * n_seasons + (seasons[present] - first_season)
+    totals = numpy.bincount(bins, weights=values[present], minlength=n_locations * n_seasons).reshape(n_locations, n_seasons)
+    counts = numpy.bincount(bins, minlength=n_locations * n_seasons).reshape(n_locations, n_seasons)
+    return numpy.arange(first_season, first_season + n_seasons), numpy.where(counts > 0, totals, numpy.nan)
+
+# ----------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('action', choices=['build', 'season-totals'])
+    parser.add_argument('--archive-dir', required=True)
+    parser.add_argument('--history-dir', default='_history', help='for build')
+    parser.add_argument('--history-db', help='for build: read from this sqlite file (see historydb.py) instead of the csvs')
+    parser.add_argument('--var', default='snow', choices=archive_vars, help='for season-totals')
+    parser.add_argument('--season-start-month', type=int, default=10, help='for season-totals')
+    args = parser.parse_args()
+
+    if args.action == 'build':
+        historydb.dbfname = args.history_db
+        n_rows, n_locations = build(args.history_dir, args.archive_dir)
+        print('wrote %d rows for %d locations to %s' % (n_rows, n_locations, args.archive_dir))
+    else:
+        archive = load(args.archive_dir)
+        seasons, totals = get_season_totals(archive, var=args.var, season_start_month=args.season_start_month)
+        print('%s totals (%s) by season' % (args.var, archive_units[args.var]))
+        print('%-30s %s' % ('', ''.join('%9s' % ('%d-%02d' % (season, (season + 1) % 100)) for season in seasons)))
+        for ilocation, name in enumerate(archive['location-names']):
+            source = archive['sources'][archive['location-sources'][ilocation]]
+            print('%-30s %s' % ('%s (%s)' % (name, source), ''.join('%9s' % ('%.1f' % total if not numpy.isnan(total) else '-') for total in totals[ilocation])))
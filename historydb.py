@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# optional sqlite backend for the history: if <dbfname> is set (scrape.py --history-db), read_rows() and append_rows() use one table per source in that file, instead of the csvs in historylog.py
+# rows are still named by the csv they'd otherwise be in, i.e. <history dir>/<source>/<location>.csv, which is also how the importer and exporter below map between the two, e.g.:
+#   ./historydb.py import --db _history.db --history-dir _history
+#   ./historydb.py export --db _history.db --history-dir ../weatherhistory
+import os
+import csv
+import glob
+import sqlite3
+import datetime
+import argparse
+
+import historylog
+
+dbfname = None
+source_vars = {'mtwx' : ['high', 'low', 'rain', 'snow', 'wind-speed', 'wind-direction'],  # one row per time of day (see mtwxparser.slot_vars)...
+               'noaa' : ['hi', 'lo', 'liquid', 'snow', 'wind']}  # ...and one per day
+connection = None
+
+# ----------------------------------------------------------------------------------------
+def get_header(source):
+    """ columns of the csvs for <source> """
+    return ['month', 'day', 'year'] + (['time-of-day'] if source == 'mtwx' else []) + source_vars[source]
+
+# ----------------------------------------------------------------------------------------
+def get_source_and_location(fname):
+    """ e.g. _history/noaa/Stevens Pass.csv --> (noaa, Stevens Pass) """
+    source = os.path.basename(os.path.dirname(os.path.abspath(fname)))
+    if source not in source_vars:
+        raise Exception('unknown history source %s (from %s)' % (source, fname))
+    return source, os.path.splitext(os.path.basename(fname))[0]
+
+# ----------------------------------------------------------------------------------------
+def quote(name):
+    return '"%s"' % name
+
+# ----------------------------------------------------------------------------------------
+def connect():
+    """ open (and if need be create) the database, keeping the connection around for subsequent calls """
+    global connection
+    if connection is None:
+        connection = sqlite3.connect(dbfname)
+        for source, variables in source_vars.items():  # time_of_day is '' for daily rows, so it can be part of the primary key
+            connection.execute('create table if not exists %s (location text not null, date text not null, time_of_day text not null, %s, primary key (location, date, time_of_day))' % (source, ', '.join('%s real' % quote(var) for var in variables)))
+            connection.execute('create index if not exists %s_date on %s (date)' % (source, source))  # for queries across locations
+        connection.commit()
+    return connection
+
+# ----------------------------------------------------------------------------------------
+def read_rows(fname, start_date=None):
+    """ same as historylog.read_rows(), except values are floats (or None) rather than strings """
+    if dbfname is None:
+        return historylog.read_rows(fname, start_date=start_date)
+    source, location = get_source_and_location(fname)
+    query = 'select date, time_of_day, %s from %s where location = ?' % (', '.join(quote(var) for var in source_vars[source]), source)
+    params = [location]
+    if start_date is not None:
+        query += ' and date >= ?'
+        params.append(start_date.isoformat())
+    rows = []
+    for values in connect().execute(query + ' order by date, time_of_day', params):  # AM, PM, night happen to sort correctly
+        date = datetime.datetime.strptime(values[0], '%Y-%m-%d').date()
+        row = dict(zip(source_vars[source], values[2:]))
+        row.update({'month' : date.month, 'day' : date.day, 'year' : date.year})
+        if source == 'mtwx':
+            row['time-of-day'] = values[1]
+        rows.append(row)
+    return rows
+
+# ----------------------------------------------------------------------------------------
+def write_rows(source, location, rows):
+    """ insert (or replace) each dict in <rows>, without committing """
+    variables = source_vars[source]
+    query = 'insert or replace into %s (location, date, time_of_day, %s) values (?, ?, ?, %s)' % (source, ', '.join(quote(var) for var in variables), ', '.join('?' for _ in variables))
+    connect().executemany(query, [[location, historylog.get_date(row).isoformat(), row.get('time-of-day', '')] + [float(row[var]) if row[var] not in ('', None) else None for var in variables] for row in rows])
+
+# ----------------------------------------------------------------------------------------
+def append_rows(fname, header, rows, skip_unchanged=True):
+    """ same as historylog.append_rows(), except existing rows for the same date (and time of day) are replaced (so <skip_unchanged> doesn't matter) """
+    if dbfname is None:
+        historylog.append_rows(fname, header, rows, skip_unchanged=skip_unchanged)
+        return
+    source, location = get_source_and_location(fname)
+    if list(header) != get_header(source):
+        raise Exception('header %s for %s doesn\'t match %s' % (header, fname, get_header(source)))
+    write_rows(source, location, rows)
+    connect().commit()
+
+# ----------------------------------------------------------------------------------------
+def list_fnames(history_dir, source):
+    """ history fname for each location we have for <source> (whichever backend we're using) """
+    if dbfname is None:
+        return sorted(glob.glob(history_dir + '/' + source + '/*.csv'))
+    return [history_dir + '/' + source + '/' + location + '.csv' for location, in connect().execute('select distinct location from %s order by location' % source)]
+
+# ----------------------------------------------------------------------------------------
+def import_csvs(history_dir):
+    for source in source_vars:
+        for fname in sorted(glob.glob(history_dir + '/' + source + '/*.csv')):
+            _, location = get_source_and_location(fname)
+            rows = historylog.read_rows(fname)
+            write_rows(source, location, rows)  # in file order, so later rows replace earlier ones, same as for the csvs
+            print('  %s %s: %d rows' % (source, location, len(rows)))
+    connect().commit()
+
+# ----------------------------------------------------------------------------------------
+def export_csvs(history_dir):
+    """ write every location to <history_dir>/<source>/<location>.csv, sorted by date and time of day (i.e. the same as after sort-csvs.py) """
+    for source in source_vars:
+        fnames = list_fnames(history_dir, source)
+        if len(fnames) > 0 and not os.path.exists(history_dir + '/' + source):
+            os.makedirs(history_dir + '/' + source)
+        for fname in fnames:
+            _, location = get_source_and_location(fname)
+            rows = read_rows(fname)
+            with open(fname + '.part', 'wb') as histfile:
+                writer = csv.DictWriter(histfile, get_header(source))
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow({key : (val if val is not None else '') for key, val in row.items()})
+            os.rename(fname + '.part', fname)
+            print('  %s %s: %d rows' % (source, location, len(rows)))
+
+# ----------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('action', choices=['import', 'export'], help='import: copy the csvs in --history-dir into --db (replacing any existing rows for the same location, date, and time of day)   export: write everything in --db out as csvs in --history-dir')
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--history-dir', required=True)
+    args = parser.parse_args()
+    dbfname = args.db
+    if args.action == 'import':
+        import_csvs(args.history_dir)
+    else:
+        export_csvs(args.history_dir)
@@ -0,0 +1,168 @@
+# per-location history files are append-only csvs: each run appends only the rows that changed, and a later row for the same date (and time of day, if there is one) supersedes any earlier one
+# next to each one is <fname>.index, a few bytes per day saying where in the file each new latest date starts, so reading the last few days can seek straight to the tail instead of reading the whole archive
+# to compact them, i.e. rewrite each file sorted by get_sort_key() with only the latest row for each date (and time of day), use sort-csvs.py
+import os
+import io
+import csv
+import datetime
+from collections import OrderedDict
+
+import utils
+
+index_suffix = '.index'
+index_chunk_size = 4096  # bytes to read at a time from the end of the index
+
+# ----------------------------------------------------------------------------------------
+def get_date(row):
+    return datetime.date(int(row['year']), int(row['month']), int(row['day']))
+
+# ----------------------------------------------------------------------------------------
+def get_sort_key(row):
+    """ (date, index in utils.times_of_day or -1 for daily rows), which is the order compacted files are in """
+    return get_date(row), (utils.times_of_day.index(row['time-of-day']) if 'time-of-day' in row else -1)
+
+# ----------------------------------------------------------------------------------------
+def get_key_fields(header):
+    """ columns (besides the date) that say which rows supersede which """
+    return ['time-of-day'] if 'time-of-day' in header else []
+
+# ----------------------------------------------------------------------------------------
+def get_key(row, key_fields):
+    return (get_date(row), ) + tuple(row[field] for field in key_fields)
+
+# ----------------------------------------------------------------------------------------
+def format_line(header, row):
+    """ return (the csv line for dict <row>, <row> as it'll look when it's read back in) """
+    outbuf = io.BytesIO()
+    csv.DictWriter(outbuf, header).writerow(row)
+    line = outbuf.getvalue()
+    return line, dict(zip(header, next(csv.reader([line]))))
+
+# ----------------------------------------------------------------------------------------
+def read_header(fname):
+    with open(fname, 'rb') as histfile:
+        return next(csv.reader([histfile.readline()]))
+
+# ----------------------------------------------------------------------------------------
+def index_is_stale(fname):
+    """ true if the index is missing, or if something other than us (e.g. an old version, or a text editor) has written to <fname> since we last updated it """
+    index_fname = fname + index_suffix
+    return not os.path.exists(index_fname) or os.path.getmtime(index_fname) < os.path.getmtime(fname)
+
+# ----------------------------------------------------------------------------------------
+def build_index(fname):
+    """
+    Scan all of <fname>, writing an index entry (date, offset) for each row whose date is later than any before it.
+    So every row before <offset> is earlier than <date>, no matter what order they were appended in.
+    """
+    entries = []
+    with open(fname, 'rb') as histfile:
+        header = next(csv.reader([histfile.readline()]))
+        offset = histfile.tell()
+        for line in iter(histfile.readline, b''):
+            if line.strip() != b'':
+                date = get_date(dict(zip(header, next(csv.reader([line])))))
+                if len(entries) == 0 or date > entries[-1][0]:
+                    entries.append((date, offset))
+            offset += len(line)
+    with open(fname + index_suffix + '.part', 'wb') as indexfile:
+        for date, offset in entries:
+            indexfile.write('%s %d\n' % (date.isoformat(), offset))
+    os.rename(fname + index_suffix + '.part', fname + index_suffix)
+
+# ----------------------------------------------------------------------------------------
+def iter_index_backwards(fname):
+    """ yield (date, offset) for each entry in the index, starting from the end, and only reading as much of the file as we need """
+    with open(fname + index_suffix, 'rb') as indexfile:
+        indexfile.seek(0, os.SEEK_END)
+        end = indexfile.tell()
+        chunk_size = index_chunk_size
+        while end > 0:
+            start = max(0, end - chunk_size)
+            indexfile.seek(start)
+            lines = indexfile.read(end - start).split(b'\n')
+            if start > 0:  # first line is probably partial, so leave it for the next chunk
+                end = start + len(lines[0])
+                lines = lines[1:]
+            else:
+                end = 0
+            for line in reversed(lines):
+                if line.strip() == b'':
+                    continue
+                datestr, offset = line.split()
+                yield datetime.datetime.strptime(datestr, '%Y-%m-%d').date(), int(offset)
+            chunk_size *= 2
+
+# ----------------------------------------------------------------------------------------
+def find_offset(fname, start_date):
+    """ byte offset in <fname> before which every row is earlier than <start_date> (None if we have to read from the top) """
+    if index_is_stale(fname):
+        build_index(fname)
+    for date, offset in iter_index_backwards(fname):
+        if date <= start_date:
+            return offset
+    return None
+
+# ----------------------------------------------------------------------------------------
+def read_rows(fname, start_date=None):
+    """ list of dicts for each row in <fname> (in the order they were written) that's dated <start_date> or later (or all of them, if it's None) """
+    if not os.path.exists(fname):
+        return []
+    offset = find_offset(fname, start_date) if start_date is not None else None
+    rows = []
+    with open(fname, 'rb') as histfile:
+        header = next(csv.reader([histfile.readline()]))
+        if offset is not None:
+            histfile.seek(offset)
+        for values in csv.reader(histfile):
+            if len(values) == 0:
+                continue
+            row = dict(zip(header, values))
+            if start_date is None or get_date(row) >= start_date:
+                rows.append(row)
+    return rows
+
+# ----------------------------------------------------------------------------------------
+def latest_rows(rows, key_fields):
+    """ OrderedDict of key : row, where each row is the last one in <rows> with that key (but in the position of the first one) """
+    latest = OrderedDict()
+    for row in rows:
+        latest[get_key(row, key_fields)] = row
+    return latest
+
+# ----------------------------------------------------------------------------------------
+def append_rows(fname, header, rows, skip_unchanged=True):
+    """ append each dict in <rows> to <fname> (creating it if need be), skipping (if <skip_unchanged> is set) the ones that are the same as what's already there for their date (and time of day) """
+    if len(rows) == 0:
+        return
+    key_fields = get_key_fields(header)
+    lines = [format_line(header, row) for row in rows]
+    if os.path.exists(fname):
+        if read_header(fname) != list(header):
+            raise Exception('header %s in %s doesn\'t match %s' % (read_header(fname), fname, header))
+        if skip_unchanged:
+            latest = latest_rows(read_rows(fname, start_date=min(get_date(row) for _, row in lines)), key_fields)
+            lines = [(line, row) for line, row in lines if latest.get(get_key(row, key_fields)) != row]
+            if len(lines) == 0:
+                return
+    else:
+        if not os.path.exists(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with open(fname, 'wb') as histfile:
+            csv.writer(histfile).writerow(header)
+    if index_is_stale(fname):
+        build_index(fname)
+
+    last_date = next(iter_index_backwards(fname), (None, None))[0]
+    new_entries = []
+    with open(fname, 'ab') as histfile:
+        histfile.seek(0, os.SEEK_END)
+        for line, row in lines:
+            if last_date is None or get_date(row) > last_date:
+                last_date = get_date(row)
+                new_entries.append((last_date, histfile.tell()))
+            histfile.write(line)
+    with open(fname + index_suffix, 'ab') as indexfile:  # NOTE always open it, so its mtime is later than <fname>'s
+        for date, offset in new_entries:
+            indexfile.write('%s %d\n' % (date.isoformat(), offset))
+    os.utime(fname + index_suffix, None)
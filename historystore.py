@@ -0,0 +1,64 @@
+import datetime
+from collections import OrderedDict
+
+import historylog
+import historydb
+
+# ----------------------------------------------------------------------------------------
+def normalize(value):
+    """ so e.g. '35' from a csv and 35.0 from the database compare equal """
+    if value in ('', None):
+        return ''
+    try:
+        return float(value)
+    except ValueError:
+        return str(value)
+
+# ----------------------------------------------------------------------------------------
+def same_row(header, row_a, row_b):
+    return all(normalize(row_a.get(column)) == normalize(row_b.get(column)) for column in header)
+
+# ----------------------------------------------------------------------------------------
+class historystore(object):
+    """
+    Recent history for every location, shared by the parsers for the whole run.
+    Each location's history file (or its rows in the database, see historydb.py) is read the first time it's asked for, starting <n_days> before today, and any rows that change are written back all at once by flush() at the end of the run.
+    """
+    def __init__(self, n_days=6):
+        self.start_date = datetime.date.today() - datetime.timedelta(days=n_days)
+        self.rows = {}  # history fname : OrderedDict of (date, time of day) : row, i.e. the latest row for each
+        self.dirty = OrderedDict()  # history fname : (header, OrderedDict of (date, time of day) : row) for rows we need to write
+
+    # ----------------------------------------------------------------------------------------
+    def load(self, fname):
+        if fname not in self.rows:
+            self.rows[fname] = OrderedDict()
+            for row in historydb.read_rows(fname, start_date=self.start_date):
+                self.rows[fname][(historylog.get_date(row), row.get('time-of-day', ''))] = row  # later rows supersede earlier ones
+        return self.rows[fname]
+
+    # ----------------------------------------------------------------------------------------
+    def get(self, fname, date, time_of_day=''):
+        """ row (dict) for <date> (and <time_of_day>, for mtwx) in <fname>, or None if there isn't one """
+        if date < self.start_date:
+            raise Exception('asked for %s from %s, but we only read back to %s' % (date, fname, self.start_date))
+        return self.load(fname).get((date, time_of_day))
+
+    # ----------------------------------------------------------------------------------------
+    def set(self, fname, header, row):
+        """ replace the row for <row>'s date (and time of day), and remember to write it unless it's the same as what was there """
+        key = (historylog.get_date(row), row.get('time-of-day', ''))
+        existing = self.get(fname, key[0], key[1])
+        if existing is not None and same_row(header, existing, row):
+            return
+        self.load(fname)[key] = row
+        if fname not in self.dirty:
+            self.dirty[fname] = (header, OrderedDict())
+        self.dirty[fname][1][key] = row
+
+    # ----------------------------------------------------------------------------------------
+    def flush(self):
+        """ write all the rows that changed, one append for each file """
+        for fname, (header, rows) in self.dirty.items():
+            historydb.append_rows(fname, header, list(rows.values()), skip_unchanged=False)  # we already know they changed
+        self.dirty = OrderedDict()
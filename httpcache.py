@@ -0,0 +1,91 @@
+import os
+import time
+import json
+import gzip
+import requests
+
+import httpclient
+
+compress_level = 6  # 9 is a lot slower for not much smaller files
+
+# ----------------------------------------------------------------------------------------
+def get_meta_fname(cachefname):
+    return cachefname + '.meta'
+def get_gzip_fname(cachefname):
+    return cachefname + '.gz'
+
+# ----------------------------------------------------------------------------------------
+def read_cache(cachefname):
+    """ return (payload, metadata) for <cachefname> (decompressing it if necessary), or (None, None) if it isn't there """
+    if os.path.exists(get_gzip_fname(cachefname)):
+        with gzip.open(get_gzip_fname(cachefname), 'rb') as cachefile:
+            payload = cachefile.read()
+    elif os.path.exists(cachefname):  # uncompressed, from before we started compressing them (or put there by hand)
+        with open(cachefname, 'rb') as cachefile:
+            payload = cachefile.read()
+    else:
+        return None, None
+    meta = {}
+    if os.path.exists(get_meta_fname(cachefname)):  # files cached before we started writing metadata don't have it
+        with open(get_meta_fname(cachefname)) as metafile:
+            meta = json.load(metafile)
+    return payload, meta
+
+# ----------------------------------------------------------------------------------------
+def write_meta(cachefname, meta):
+    with open(get_meta_fname(cachefname), 'w') as metafile:
+        json.dump(meta, metafile, sort_keys=True, indent=1)
+
+# ----------------------------------------------------------------------------------------
+def write_cache(cachefname, payload, meta):
+    """ write the raw bytes in <payload>, compressed, to <cachefname>.gz """
+    if not os.path.exists(os.path.dirname(cachefname)):
+        os.makedirs(os.path.dirname(cachefname))
+    with gzip.open(get_gzip_fname(cachefname), 'wb', compress_level) as cachefile:
+        cachefile.write(payload)
+    if os.path.exists(cachefname):  # remove any old uncompressed version, so it doesn't get read by accident
+        os.remove(cachefname)
+    write_meta(cachefname, meta)
+
+# ----------------------------------------------------------------------------------------
+def fetch(url, cachefname, ttl=None, timeout=httpclient.default_timeout):
+    """
+    Return (payload, status) for <url>, where status is one of:
+      'fresh':        cached copy is younger than <ttl> seconds, so we didn't ask the server at all
+      'not-modified': server said (with a 304) that our cached copy is still good
+      'modified':     downloaded a new copy (and cached it)
+      'stale':        couldn't get through to the server (even after retrying), so fell back to the cached copy, however old it is
+    """
+    payload, meta = read_cache(cachefname)
+    if payload is not None and meta.get('url') == url:
+        if ttl is not None and 'fetch-time' in meta and time.time() - meta['fetch-time'] < ttl:
+            return payload, 'fresh'
+    else:  # nothing cached, or it was cached for a different url (e.g. different start date)
+        payload, meta = None, {}
+
+    headers = {}
+    if meta.get('etag') is not None:
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last-modified') is not None:
+        headers['If-Modified-Since'] = meta['last-modified']
+
+    try:
+        resp = httpclient.get(url, headers=headers, timeout=timeout)
+        if resp.status_code != 304:
+            resp.raise_for_status()
+    except requests.RequestException:
+        if payload is None:
+            raise
+        return payload, 'stale'
+    if resp.status_code == 304:
+        meta['fetch-time'] = time.time()
+        write_meta(cachefname, meta)
+        return payload, 'not-modified'
+
+    payload = resp.content
+    meta = {'url' : url,
+            'fetch-time' : time.time(),
+            'etag' : resp.headers.get('ETag'),
+            'last-modified' : resp.headers.get('Last-Modified')}
+    write_cache(cachefname, payload, meta)
+    return payload, 'modified'
@@ -0,0 +1,149 @@
+# shared keep-alive http client, so repeated requests to the same host reuse their connections instead of setting up a new one (and for https, a new tls session) each time
+# NOTE used by both scrape.py (python 2) and wrfparser (python 3), so has to work with either
+import os
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests.compat import urlparse
+
+default_pool_size = 4  # max connections kept open to each host
+default_timeout = (10, 30)  # (connect, read) seconds for each attempt
+
+n_tries = 3  # attempts per request (including the first one)
+backoff_base = 1.  # seconds to wait (on average, before jitter) after the first failure, doubling after each subsequent one
+backoff_max = 30.
+retry_status_codes = (429, 500, 502, 503, 504)  # anything else is the server telling us something that won't change if we ask again
+retry_exceptions = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)  # ...and likewise for anything other than the connection dying
+breaker_threshold = 5  # stop sending requests to a host after this many consecutive failures...
+breaker_cooldown = 300.  # ...for this many seconds, after which we let one request through to see if it's back
+replay_url = None  # if set, send everything here instead (see replayserver.py), with the original host as the first part of the path
+
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_maxsize=default_pool_size))
+session.mount('https://', HTTPAdapter(pool_maxsize=default_pool_size))
+
+# ----------------------------------------------------------------------------------------
+class HostUnavailable(requests.RequestException):
+    """ raised without sending anything when a host's circuit breaker is open """
+    pass
+
+# ----------------------------------------------------------------------------------------
+class CircuitBreaker(object):
+    def __init__(self, host):
+        self.host = host
+        self.n_failures = 0  # consecutive
+        self.open_until = None
+        self.lock = threading.Lock()
+
+    def check(self):
+        with self.lock:
+            if self.open_until is None:
+                return
+            if time.time() < self.open_until:
+                raise HostUnavailable('%d consecutive failures for %s, not trying again for %.0fs' % (self.n_failures, self.host, self.open_until - time.time()))
+            self.open_until = time.time() + breaker_cooldown  # half open: let this one through, but nobody else until we hear how it went
+
+    def succeeded(self):
+        with self.lock:
+            self.n_failures = 0
+            self.open_until = None
+
+    def failed(self):
+        with self.lock:
+            self.n_failures += 1
+            if self.n_failures >= breaker_threshold:
+                self.open_until = time.time() + breaker_cooldown
+
+breakers = {}
+breaker_lock = threading.Lock()
+
+# ----------------------------------------------------------------------------------------
+def get_host(url):
+    return urlparse(url).netloc
+
+# ----------------------------------------------------------------------------------------
+def rewrite_url(url):
+    """ where to actually send the request for <url> """
+    if replay_url is None:
+        return url
+    parsed = urlparse(url)
+    return replay_url.rstrip('/') + '/' + parsed.netloc + parsed.path + ('?' + parsed.query if parsed.query != '' else '')
+
+# ----------------------------------------------------------------------------------------
+def get_breaker(host):
+    with breaker_lock:
+        if host not in breakers:
+            breakers[host] = CircuitBreaker(host)
+        return breakers[host]
+
+# ----------------------------------------------------------------------------------------
+def set_pool_size(host, pool_size):
+    """ keep up to <pool_size> connections open to <host> (make it at least as big as the number of threads that'll be hitting <host>) """
+    for scheme in ('http://', 'https://'):
+        session.mount(scheme + host, HTTPAdapter(pool_maxsize=pool_size))
+
+# ----------------------------------------------------------------------------------------
+def get_backoff(itry):
+    """ exponential backoff with full jitter, so a bunch of threads that failed at the same time don't all come back at the same time """
+    return random.uniform(0, min(backoff_max, backoff_base * 2**itry))
+
+# ----------------------------------------------------------------------------------------
+def send_with_retries(url, send):
+    """
+    Call <send> (which returns a response) until we get something other than a connection error or one of <retry_status_codes>, or we've tried <n_tries> times, backing off in between.
+    Returns the last response, whatever its status (so the caller decides what to do about e.g. 404s), and only counts it as a failure for the host's circuit breaker if every attempt failed.
+    """
+    breaker = get_breaker(get_host(url))
+    for itry in range(n_tries):
+        breaker.check()
+        try:
+            resp = send()
+        except retry_exceptions:
+            if itry == n_tries - 1:
+                breaker.failed()
+                raise
+            time.sleep(get_backoff(itry))
+            continue
+        if resp.status_code in retry_status_codes:
+            resp.close()
+            if itry == n_tries - 1:
+                breaker.failed()
+                return resp
+            time.sleep(get_backoff(itry))
+            continue
+        breaker.succeeded()  # a 404 still means the host is up
+        return resp
+
+# ----------------------------------------------------------------------------------------
+def get(url, headers=None, timeout=default_timeout, stream=False):
+    """ NOTE doesn't raise for bad status codes (including the ones we retry, if we run out of tries), since e.g. 304s are fine -- use resp.raise_for_status() if you want that """
+    return send_with_retries(url, lambda: session.get(rewrite_url(url), headers=headers, timeout=timeout, stream=stream))
+
+# ----------------------------------------------------------------------------------------
+def download(url, outfname, headers=None, timeout=default_timeout, chunk_size=65536):
+    """
+    Write the contents of <url> to <outfname>, returning the response (whose body has already been consumed).
+    If <headers> makes it a conditional request and the server says 304, <outfname> is left alone.
+    """
+    def send():  # retry the whole thing if the connection dies partway through
+        resp = session.get(rewrite_url(url), headers=headers, timeout=timeout, stream=True)
+        try:
+            if resp.status_code < 300:
+                try:
+                    with open(outfname + '.part', 'wb') as outfile:  # so we don't clobber any existing file unless we get the whole thing
+                        for chunk in resp.iter_content(chunk_size=chunk_size):
+                            outfile.write(chunk)
+                    os.rename(outfname + '.part', outfname)
+                except:  # don't leave partial files lying around (whether or not we're about to retry)
+                    if os.path.exists(outfname + '.part'):
+                        os.remove(outfname + '.part')
+                    raise
+        finally:
+            resp.close()  # hands the connection back to the pool
+        return resp  # send_with_retries() deals with retry status codes, and the caller with 304s
+    resp = send_with_retries(url, send)
+    if resp.status_code != 304:
+        resp.raise_for_status()
+    return resp
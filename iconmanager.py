@@ -0,0 +1,71 @@
+import os
+import time
+import json
+import requests
+
+import fetcher
+
+missing_icon_file = 'missing.jpg'
+negative_ttl = 7 * 24 * 3600  # seconds before we try again for an icon that wasn't there
+
+# ----------------------------------------------------------------------------------------
+def fix_icon_url(icon_url):
+    return icon_url.replace('http://forecast.weather.gov/images/wtf', 'http://www.nws.noaa.gov/weather/images/fcicons')  # some of the images seem to not be at the orignal url, but if you google them...
+
+# ----------------------------------------------------------------------------------------
+class iconmanager(object):
+    """
+    Collects the condition icon urls from all the locations, then downloads the ones we don't have all at once at the end of the run.
+    Keeps a manifest of the icons we know about (including the ones that weren't on the server), so we don't keep asking for missing ones every run.
+    """
+    def __init__(self, imagedir, manifest_fname):
+        self.imagedir = imagedir
+        self.manifest_fname = manifest_fname
+        self.urls = {}  # icon file : url for each icon we've been asked for this run
+        self.manifest = {}  # icon file : {'url' : url, 'found' : bool, 'time' : time we last tried to download it}
+        if os.path.exists(self.manifest_fname):
+            with open(self.manifest_fname) as manifestfile:
+                self.manifest = json.load(manifestfile)
+
+    # ----------------------------------------------------------------------------------------
+    def add(self, icon_url):
+        """ return the file name to use in the html for <icon_url> (which can be None), and remember to download it """
+        if icon_url is None:
+            return missing_icon_file
+        icon_url = fix_icon_url(icon_url)
+        icon_file = os.path.basename(icon_url)
+        self.urls[icon_file] = icon_url
+        return icon_file
+
+    # ----------------------------------------------------------------------------------------
+    def needs_download(self, icon_file):
+        if os.path.exists(self.imagedir + '/' + icon_file):
+            return False
+        info = self.manifest.get(icon_file)
+        if info is not None and not info['found'] and info['url'] == self.urls[icon_file] and time.time() - info['time'] < negative_ttl:
+            return False  # already know it isn't there
+        return True
+
+    # ----------------------------------------------------------------------------------------
+    def download_missing(self, max_connections=None):
+        if not os.path.exists(self.imagedir):
+            os.makedirs(self.imagedir)
+        jobs = [{'key' : icon_file, 'url' : self.urls[icon_file]} for icon_file in sorted(self.urls) if self.needs_download(icon_file)]
+        if len(jobs) == 0:
+            return
+        print 'downloading %d icons' % len(jobs)
+        for icon_file, payload, _, error in fetcher.fetch_all(jobs, max_connections=max_connections):
+            if error is None:
+                with open(self.imagedir + '/' + icon_file, 'wb') as iconfile:
+                    iconfile.write(payload)
+                self.manifest[icon_file] = {'url' : self.urls[icon_file], 'found' : True, 'time' : time.time()}
+            elif isinstance(error, requests.HTTPError) and error.response is not None and error.response.status_code == 404:
+                print '  %s not found at %s' % (icon_file, self.urls[icon_file])
+                self.manifest[icon_file] = {'url' : self.urls[icon_file], 'found' : False, 'time' : time.time()}
+            else:  # don't remember other failures, they might work next time
+                print '  failed downloading %s: %s' % (self.urls[icon_file], error)
+
+        if not os.path.exists(os.path.dirname(self.manifest_fname)):
+            os.makedirs(os.path.dirname(self.manifest_fname))
+        with open(self.manifest_fname, 'w') as manifestfile:
+            json.dump(self.manifest, manifestfile, sort_keys=True, indent=1)
@@ -2,10 +2,8 @@ import datetime
 from lxml import etree
 import os
 import sys
-import copy
 import math
 import numpy
-import csv
 from collections import OrderedDict
 
 import plotting
@@ -27,65 +25,224 @@ def mm_to_in(distance):
 def meters_to_feet(distance):
     return 39.370079 * distance / 12
 
+# ----------------------------------------------------------------------------------------
+class PageLayoutError(Exception):
+    """ mountain-forecast changed their page layout, so we can't tell where things are any more """
+    pass
+
+simple_rows = OrderedDict([('snow', ('Snow (', 'cm')), ('rain', ('Rain (', 'mm')), ('high', ('High', 'C')), ('low', ('Low', 'C'))])  # name : (start of row header, expected units)
+
+# compiled once, rather than walking the whole tree with find()/findall() for every row and cell of every page
+day_header_xpath = etree.XPath('//tr[@class="lar hea "]')
+tod_header_xpath = etree.XPath('//tr[@class="lar hea1"]')
+labeled_row_xpath = etree.XPath('//tr[th[1][starts-with(normalize-space(text()[1]), $label)]]')
+header_units_xpath = etree.XPath('string(th[1]/descendant::span[1])')
+header_switch_xpath = etree.XPath('string(th[1]/descendant::nobr[1])')
+cells_xpath = etree.XPath('td')
+cell_spans_xpath = etree.XPath('td/descendant::span[1]')
+wind_alts_xpath = etree.XPath('td/descendant::img[1]/@alt')
+row_label_xpath = etree.XPath('normalize-space(th[1]/text()[1])')  # what labeled_row_xpath compares to $label
+
+# ----------------------------------------------------------------------------------------
+def get_row(tree, xpath, description, **kwargs):
+    rows = xpath(tree, **kwargs)
+    if len(rows) != 1:
+        raise PageLayoutError('expected one %s row, but found %d' % (description, len(rows)))
+    return rows[0]
+
+# ----------------------------------------------------------------------------------------
+def get_cell_spans(tr, description):
+    """ the first <span> in each <td> in <tr> """
+    spans = cell_spans_xpath(tr)
+    if len(spans) != len(cells_xpath(tr)):
+        raise PageLayoutError('only found %d spans in %d %s cells' % (len(spans), len(cells_xpath(tr)), description))
+    return spans
+
+# ----------------------------------------------------------------------------------------
+def check_units(tr, description, expected_units):
+    units = header_units_xpath(tr)
+    if units != expected_units:
+        raise PageLayoutError('bad %s units: expected %s but got %s' % (description, expected_units, units))
+
+# ----------------------------------------------------------------------------------------
+def extract_forecast_table(tree):
+    """
+    Pull what we need out of the forecast table in <tree> with the precompiled xpaths above, returning a dict with
+      'days':          (weekday, day of month) for each day column (day of month is None if they don't give all three times of day for that day)
+      'tods':          time of day for each column
+      'wind-speed', 'wind-direction', 'snow', 'rain', 'high', 'low':
+                       float array with the value in each column (converted to imperial units, if we're using them)
+    Raises PageLayoutError if anything isn't where we expect it to be.
+    """
+    table = {}
+
+    dayrow = get_row(tree, day_header_xpath, 'day header')
+    if header_switch_xpath(dayrow) != 'Metric':  # this isn't saying the numbers are metric (although they probably are), it's just how they arrange the radio buttons
+        raise PageLayoutError('either an unexpected tag, or the wrong units')
+    table['days'] = []
+    for td in cells_xpath(dayrow):
+        if td.find('b') is None:  # if they don't give you all thre time periods for a day, there's no <b> tag, no date, and the day of week is abbreviated
+            table['days'].append((td.text.strip(), None))
+        else:
+            table['days'].append((td.find('b').text[:3], int(td.find('b').tail)))  # not abbreviated
+
+    table['tods'] = [span.text for span in get_cell_spans(get_row(tree, tod_header_xpath, 'time of day header'), 'time of day')]
+    n_columns = len(table['tods'])
+
+    windrow = get_row(tree, labeled_row_xpath, 'wind', label='Wind')
+    check_units(windrow, 'wind', 'km/h')
+    alts, spans = wind_alts_xpath(windrow), get_cell_spans(windrow, 'wind')
+    if len(alts) != n_columns or len(spans) != n_columns:
+        raise PageLayoutError('different number of times of day %d and wind cells %d' % (n_columns, len(alts)))
+    speeds, directions = [], []
+    for alt, span in zip(alts, spans):
+        speed, direction = alt.split()
+        if int(span.text) != int(speed):  # they put the info in there twice, we may as well make sure it's the same (NOTE one of these stays in kph in the source html if you click the 'imperial' radio button)
+            raise PageLayoutError('wind speeds don\'t match up %d %d' % (int(speed), int(span.text)))
+        speeds.append(int(speed))
+        directions.append(utils.convert_wind_direction_to_angle(direction))
+    table['wind-speed'] = numpy.array(speeds, dtype=float)
+    table['wind-direction'] = numpy.array(directions, dtype=float)
+    if imperial_units:
+        table['wind-speed'] = kph_to_mph(table['wind-speed'])
+
+    for name, (label, expected_units) in simple_rows.items():
+        tr = get_row(tree, labeled_row_xpath, name, label=label)
+        check_units(tr, name, expected_units)
+        values = numpy.array([0 if span.text == '-' else int(span.text) for span in get_cell_spans(tr, name)], dtype=float)
+        if len(values) != n_columns:
+            raise PageLayoutError('different number of times of day %d and %s cells %d' % (n_columns, name, len(values)))
+        if imperial_units:
+            if expected_units == 'cm':
+                values = cm_to_feet(values)
+            elif expected_units == 'mm':
+                values = mm_to_in(values)
+            elif expected_units == 'C':
+                values = celsius_to_fahrenheit(values)
+        table[name] = values
+
+    return table
+
+# ----------------------------------------------------------------------------------------
+def is_forecast_row(tr):
+    """ is <tr> one of the rows extract_forecast_table() looks for? """
+    if tr.get('class') in ('lar hea ', 'lar hea1'):
+        return True
+    header = row_label_xpath(tr)
+    return any(header.startswith(label) for label in ['Wind'] + [label for label, _ in simple_rows.values()])
+
+# ----------------------------------------------------------------------------------------
+def parse_forecast_rows(payload, chunk_size=16384):
+    """
+    Parse the html in <payload> into a tree with only the forecast table rows in it (which is all extract_forecast_table() needs).
+    The page is fed to the parser a chunk at a time, and as each <tr> finishes we either move it into our table or drop it, along with everything before it on the page (all the chrome, scripts, ads...), so we never hold more than about a chunk of the rest of the page.
+    NOTE libxml2 still builds every element, so this is somewhat slower than parsing the whole page at today's page sizes -- it's only worth it if pages get big enough for memory to matter (scrape.py --mtwx-stream-parse)
+    """
+    parser = etree.HTMLPullParser(events=('end', ), tag='tr')
+    table = etree.Element('table')
+    for istart in range(0, len(payload), chunk_size):
+        parser.feed(payload[istart : istart + chunk_size])
+        for _, tr in parser.read_events():
+            for elem in [tr] + list(tr.iterancestors()):  # everything before <tr> on the page is finished (and any rows we want are already in <table>), so nobody'll need it again (NOTE has to happen before we move <tr> out of the page)
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+            if is_forecast_row(tr):
+                table.append(tr)  # moves it out of the page
+            else:
+                tr.clear()
+    parser.close()
+    return etree.ElementTree(table)
+
+# ----------------------------------------------------------------------------------------
+# each location's AM/PM/night slots live in a numpy structured array, one row per slot (in date, then time of day, order), with nan for missing values
+slot_vars = ['high', 'low', 'rain', 'snow', 'wind-speed', 'wind-direction']
+slot_dtype = numpy.dtype([('date', 'datetime64[D]'), ('itod', 'i1')] + [(var, 'f8') for var in slot_vars])  # itod is the index in utils.times_of_day
+daily_dtype = numpy.dtype([('date', 'datetime64[D]')] + [(var, 'f8') for var in slot_vars])
+
+# ----------------------------------------------------------------------------------------
+def make_slots(dates, itods=None):
+    """ empty slots (i.e. all values nan) for each date in <dates>, and for each time of day index in <itods> (default: all of them) """
+    if itods is None:
+        itods = range(len(utils.times_of_day))
+    slots = numpy.zeros(len(dates) * len(itods), dtype=slot_dtype)
+    slots['date'] = numpy.repeat(numpy.array(dates, dtype='datetime64[D]'), len(itods))
+    slots['itod'] = numpy.tile(itods, len(dates))
+    for var in slot_vars:
+        slots[var] = numpy.nan
+    return slots
+
+# ----------------------------------------------------------------------------------------
+def is_missing(slots):
+    """ mask of the slots with no values (we always have either all of them or none, so just check the first one) """
+    return numpy.isnan(slots[slot_vars[0]])
+
+# ----------------------------------------------------------------------------------------
+def combine_times_of_day(slots):
+    """
+    Reduce <slots> to one row per day: max wind (keeping its direction), summed snow and rain, and the high and low extremes.
+    <slots> can be any number of whole AM/PM/night days (e.g. history and forecasts stacked together), which we reshape to (days, 3) and reduce all at once.
+    A day with any missing slot is missing (nan) in the result.
+    """
+    n_tods = len(utils.times_of_day)
+    days = slots[ : n_tods * (len(slots) // n_tods)].reshape(-1, n_tods)  # ignore any partial day at the end
+    daily = numpy.zeros(len(days), dtype=daily_dtype)
+    daily['date'] = days['date'][:, 0]
+    daily['high'] = days['high'].max(axis=1)
+    daily['low'] = days['low'].min(axis=1)
+    daily['rain'] = days['rain'].sum(axis=1)
+    daily['snow'] = days['snow'].sum(axis=1)
+    imaxwind = numpy.argmax(numpy.where(is_missing(days), -numpy.inf, days['wind-speed']), axis=1)  # first one in case of a tie
+    daily['wind-speed'] = days['wind-speed'][numpy.arange(len(days)), imaxwind]
+    daily['wind-direction'] = days['wind-direction'][numpy.arange(len(days)), imaxwind]  # just keep track of the direction of the max wind
+    missing = is_missing(days).any(axis=1)
+    for var in slot_vars:
+        daily[var][missing] = numpy.nan
+    return daily
+
+# ----------------------------------------------------------------------------------------
+def to_dicts(slots):
+    """ convert slots (or days from combine_times_of_day()) to a list of dicts (with None for missing values), which is what plotting wants """
+    dicts = []
+    for slot in slots.tolist():  # tuples in field order, with datetime.dates
+        fcast = {}
+        for name, val in zip(slots.dtype.names, slot):
+            if name == 'itod':
+                fcast['time-of-day'] = utils.times_of_day[val]
+            elif name in slot_vars:
+                fcast[name] = None if math.isnan(val) else val
+            else:
+                fcast[name] = val
+        dicts.append(fcast)
+    return dicts
+
 # ----------------------------------------------------------------------------------------
 class mtwxparser(object):
     def __init__(self, num_days):
         self.max_history = 6
         self.num_days = num_days
         self.htmldates = []
-        self.fcast_vals = ['high', 'low', 'rain', 'snow', 'wind-speed', 'wind-direction']
+        self.fcast_vals = slot_vars
         self.history_header = ['month', 'day', 'year', 'time-of-day'] + self.fcast_vals
 
         self.today = datetime.date.today()
-        self.expected_forecast_dates = [self.today + datetime.timedelta(days=i) for i in range(self.num_days)]  # NOTE *don't* add these to <self.forecasts> (yet -- see self.combine_times_of_day())
-        self.forecasts = []
-        self.todays_history, self.todays_forecast = [], []  # the first is read from history file, the second is taken from the forecasts if it's there, otherwise it's copied from the history info
-        for tod in utils.times_of_day:
-            self.add_empty_forecast(self.todays_history, self.today, tod)
-            self.add_empty_forecast(self.todays_forecast, self.today, tod)
+        self.expected_forecast_dates = [self.today + datetime.timedelta(days=i) for i in range(self.num_days)]  # NOTE *don't* add these to <self.forecasts> (yet -- see combine_times_of_day())
+        self.forecasts = make_slots([])
+        self.todays_history, self.todays_forecast = make_slots([self.today]), make_slots([self.today])  # the first is read from history file, the second is taken from the forecasts if it's there, otherwise it's copied from the history info
         self.expected_history_dates = [self.today - datetime.timedelta(days=i) for i in range(self.max_history, 0, -1)]
-        self.history = []
-        for ed in self.expected_history_dates:
-            for tod in utils.times_of_day:
-                self.add_empty_forecast(self.history, ed, tod) # = [{'date' : ed, 'time-of-day' : tod} for ed in self.expected_history_dates for tod in utils.times_of_day]
-        self.old_history = []  # history we want to rewrite to the file, but not plot
+        self.history = make_slots(self.expected_history_dates)
 
     # ----------------------------------------------------------------------------------------
-    def add_empty_forecast(self, data, date, tod):
-        data.append({})
-        for var in utils.variables:
-            if var == 'date':
-                data[-1][var] = date
-            elif var == 'time-of-day':
-                data[-1][var] = tod
-            else:
-                data[-1][var] = None
-
-    # ----------------------------------------------------------------------------------------
-    def parse_days(self, tr):
-        """ really just checks to make sure we get the days we expect from the html """
+    def parse_days(self, days):
+        """ really just checks to make sure we get the days we expect from the html (<days> is from extract_forecast_table()) """
         assert len(self.htmldates) == 0
         htmldays, htmldaynumbers = [], []
         itoday = None
-        for child in tr:
-            if child.tag == 'th':  # header info
-                if child.find('.//nobr').text != 'Metric':  # this isn't saying the numbers are metric (although they probably are), it's just how they arrange the radio buttons
-                    raise Exception('either an unexpected tag, or the wrong units')
-            elif child.tag == 'td':  # data
-                # print child.keys()
-                if child.find('b') is None:  # if they don't give you all thre time periods for a day, there's no <b> tag, no date, and the day of week is abbreviated
-                    weekday = child.text.strip()
-                    day_of_month = None
-                else:
-                    weekday = child.find('b').text[:3]  # not abbreviated
-                    day_of_month = int(child.find('b').tail)
-                htmldays.append(weekday)
-                htmldaynumbers.append(day_of_month)
-                if weekday == utils.weekdays[self.today.weekday()]:
-                    assert itoday is None
-                    itoday = len(htmldays) - 1
-            else:
-                raise Exception('unexpected tag %s' % child.tag)
+        for weekday, day_of_month in days:
+            htmldays.append(weekday)
+            htmldaynumbers.append(day_of_month)
+            if weekday == utils.weekdays[self.today.weekday()]:
+                assert itoday is None
+                itoday = len(htmldays) - 1
 
         if itoday is None:
             raise Exception('couldn\'t find today among %s (%s)' % (htmldays, htmldaynumbers))
@@ -98,94 +255,16 @@ class mtwxparser(object):
             self.htmldates.append(date)
 
     # ----------------------------------------------------------------------------------------
-    def parse_tods(self, tr):
-        tods = []
-        for child in tr:
-            if child.tag == 'th':  # header info
-                pass  # NOTE this is where the javascript to switch units is
-            elif child.tag == 'td':
-                if child.find('span') is not None:
-                    tods.append(child.find('span').text)
-                else:
-                    raise Exception('unexpected tag in times of day %s' % child.tag)
-            else:
-                raise Exception('unexpected tag %s' % child.tag)
+    def add_forecasts(self, table):
+        """ set <self.forecasts> from the columns in <table> (from extract_forecast_table()) """
+        itods = numpy.array([utils.times_of_day.index(tod) for tod in table['tods']], dtype=int)
+        idays = numpy.cumsum((itods == 0) | (numpy.arange(len(itods)) == 0)) - 1  # a new day starts with each AM (and with the first column, whatever it is)
+        self.forecasts = numpy.zeros(len(itods), dtype=slot_dtype)
+        self.forecasts['date'] = numpy.array(self.htmldates, dtype='datetime64[D]')[idays]
+        self.forecasts['itod'] = itods
+        for var in slot_vars:
+            self.forecasts[var] = table[var]
 
-        iday = -1
-        for tod in tods:
-            if iday == -1 or tod == 'AM':
-                iday += 1
-            date = self.htmldates[iday]
-            self.add_empty_forecast(self.forecasts, date, tod)
-
-    # ----------------------------------------------------------------------------------------
-    def parse_wind(self, tr):
-        speedlist, directionlist = [], []
-        itd = 0
-        for child in tr:
-            if child.tag == 'th':  # header info
-                units = child.find('.//span').text
-                if units != 'km/h':
-                    raise Exception('unexpected wind units %s' % units)
-            elif child.tag == 'td':  # data
-                img = child.find('.//img')
-                speed, direction = img.get('alt').split()
-                speed = int(speed)
-                direction = utils.convert_wind_direction_to_angle(direction)
-    
-                span = child.find('.//span')
-                if int(span.text) != speed:  # they put the info in there twice, we may as well make sure it's the same (NOTE one of these stays in kph in the source html if you click the 'imperial' radio button)
-                    raise Exception('wind speeds don\'t match up %d %d' % (speed, int(span.text)))
-    
-                if imperial_units:
-                    speed = kph_to_mph(speed)
-    
-                speedlist.append(speed)
-                directionlist.append(direction)
-                itd += 1
-            else:
-                raise Exception('unexpected tag %s' % child.tag)
-    
-        if len(self.forecasts) != len(speedlist):
-            raise Exception('different number of days in data %d and html %d' % (len(self.forecasts), len(speedlist)))
-        for ifc in range(len(speedlist)):
-            self.forecasts[ifc]['wind-speed'] = speedlist[ifc]
-            self.forecasts[ifc]['wind-direction'] = directionlist[ifc]
-    
-    # ----------------------------------------------------------------------------------------
-    def parse_simple(self, name, tr, expected_units):
-        fcastlist = []
-        itd = 0
-        for child in tr:
-            if child.tag == 'th':  # header info
-                span = child.find('.//span')
-                # if span.get('class') != name + 'u':
-                #     raise Exception('unexpeced class name %s (expected %s)' % (span.get('class'), name + 'u'))
-                units = child.find('.//span').text
-                if units != expected_units:
-                    raise Exception('bad units: expected %s but got  %s' % (expected_units, units))
-            elif child.tag == 'td':  # data
-                span = child.find('.//span')
-                # if span.get('class') != name:
-                #     raise Exception('unexpected name %s (instead of %s)' % (span.get('class'), name))
-                value = 0 if span.text == '-' else int(span.text)
-    
-                if imperial_units:
-                    if expected_units == 'cm':
-                        value = cm_to_feet(value)
-                    elif expected_units == 'mm':
-                        value = mm_to_in(value)
-                    elif expected_units == 'C':
-                        value = celsius_to_fahrenheit(value)
-    
-                fcastlist.append(value)
-                itd += 1
-    
-        if len(self.forecasts) != len(fcastlist):
-            raise Exception('different number of days in data %d and html %d' % (len(self.forecasts), len(fcastlist)))
-        for ifc in range(len(fcastlist)):
-            self.forecasts[ifc][name] = fcastlist[ifc]
-    
     # ----------------------------------------------------------------------------------------
     def ascii(self, data):
         print '%-5s          %5s     %5s   %5s    %5s' % ('', 'hi lo', 'snow (ft)', 'rain (in)', 'wind')
@@ -199,224 +278,75 @@ class mtwxparser(object):
             print '%-12s %4.0f %-3.0f     %5.2f     %5s       %5.1f  %s' % (time, fcast['high'], fcast['low'], fcast['snow'], fcast['rain'], fcast['wind-speed'], fcast['wind-direction'])
     
     # ----------------------------------------------------------------------------------------
-    def combine_times_of_day(self, fcast):
-        """ 
-        sum/average/minmax as appropriate over AM, PM, night
-        NOTE <fcast> must be a list of length 3, for AM PM night
-        """
-        if len(fcast) != len(utils.times_of_day):
-            print fcast
-            raise Exception('bad fcast')
-        daily_fcast = {'date' : fcast[0]['date'],
-                       'wind-speed' : -9999.,
-                       'wind-direction' : 0.,
-                       'snow' : 0.,
-                       'rain' : 0.,
-                       'high' : -99999.,
-                       'low' : 99999.}
-    
-        for itod in range(len(utils.times_of_day)):  # sum/average/minmax over the three times of day
-            for key in self.fcast_vals:
-                if key in daily_fcast and daily_fcast[key] is None:  # already added it as None
-                    continue
-                if fcast[itod][key] is None:
-                    daily_fcast[key] = None
+    def read_history(self, history, history_fname):
+        """ fill in <self.history> and <self.todays_history> from the historystore <history> """
+        for ihistday, date in enumerate(self.expected_history_dates + [self.today]):
+            for itod, tod in enumerate(utils.times_of_day):
+                line = history.get(history_fname, date, tod)
+                if line is None:
                     continue
-                if key == 'wind-speed' and fcast[itod]['wind-speed'] > daily_fcast['wind-speed']:  # use the max wind speed
-                    daily_fcast['wind-speed'] = fcast[itod]['wind-speed']
-                    daily_fcast['wind-direction'] = fcast[itod]['wind-direction']  # just keep track of the direction of the max wind
-                elif key == 'wind-direction':  # fill this in while doing 'wind-speed'
-                    continue
-                elif key == 'snow' or key == 'rain':
-                    daily_fcast[key] += fcast[itod][key]
-                elif key == 'high' and fcast[itod][key] > daily_fcast[key]:
-                    daily_fcast[key] = fcast[itod][key]
-                elif key == 'low' and fcast[itod][key] < daily_fcast[key]:
-                    daily_fcast[key] = fcast[itod][key]
-        return daily_fcast
-    
-    # ----------------------------------------------------------------------------------------
-    def combine_all_times_of_day(self, forecasts):
-        # print '----'
-        # for fc in forecasts:
-        #     print fc['date'], '    ', fc
-        tod_list = [[forecasts[3*i], forecasts[3*i + 1], forecasts[3*i + 2]] for i in range(len(forecasts)/3)]
-        # for td in tod_list:
-        #     print td[0]['date'].day, td[0]['time-of-day'], td[1]['date'].day, td[1]['time-of-day'], td[2]['date'].day, td[2]['time-of-day']
-        daily_forecasts = []
-        for tod in tod_list:
-            daily_forecasts.append(self.combine_times_of_day(tod))
-        return daily_forecasts
-    
-    # ----------------------------------------------------------------------------------------
-    def read_history(self, history_fname):
-        if not os.path.exists(history_fname):
-            return
-
-        def read_history_line(csvline, historyline):
-            """  add values from <csvline> to <historyline> """
-            for k, v in csvline.items():
-                if k == 'month' or k == 'day' or k == 'year':  # only break apart the date for writing -- in the code we use a date object
-                    pass
-                elif k == 'time-of-day':
-                    pass
-                else:
-                    assert historyline['date'] == date
-                    historyline[k] = float(v)
-
-        found_days = OrderedDict()  # set of days for which we have history
-        with open(history_fname, 'r') as historyfile:
-            reader = csv.DictReader(historyfile)
-            for line in reader:
-                date = datetime.date(int(line['year']), int(line['month']), int(line['day']))
-                itod = utils.times_of_day.index(line['time-of-day'])
+                slot = (date, itod) + tuple(float(line[var]) for var in slot_vars)
                 if date == self.today:
-                    read_history_line(line, self.todays_history[itod])
-                    continue
-                elif date in self.expected_history_dates:
-                    idate = 3*self.expected_history_dates.index(date) + itod
-                else:  # add to old_history
-                    idate = None
-                if date not in found_days:
-                    found_days[date] = set()
-                if line['time-of-day'] in found_days[date]:
-                    raise Exception('got duplicate history %s %s' % (date, line['time-of-day']))
-                else:
-                    found_days[date].add(line['time-of-day'])
-                if idate is None:
-                    self.old_history.append({'date' : date, 'time-of-day' : line['time-of-day']})
-                    read_history_line(line, self.old_history[-1])
+                    self.todays_history[itod] = slot
                 else:
-                    read_history_line(line, self.history[idate])
+                    self.history[len(utils.times_of_day) * ihistday + itod] = slot
 
     # ----------------------------------------------------------------------------------------
     def combine_history_and_forecasts(self, debug=False):
-        # print 'OLD'
-        # for fc in self.old_history:
-        #     print '     ', fc['date'], '  ', fc['time-of-day'][0:2], '  ', fc['high']
-        # print 'HISTORY'
-        # for fc in self.history:
-        #     print '     ', fc['date'], '  ', fc['time-of-day'][0:2], '  ', fc['high']
-        # print 'TODAYS HISTORY'
-        # for fc in self.todays_history:
-        #     print '     ', fc['date'], '  ', fc['time-of-day'][0:2], '  ', fc['high']
-        # print 'forecasts'
-        # for fc in self.forecasts:
-        #     print '     ', fc['date'], '  ', fc['time-of-day'][0:2], '  ', fc['high']
-
         # remove any yesterdays from the forecasts
-        while self.forecasts[0]['date'] == self.today - datetime.timedelta(days=1):
+        yesterday = numpy.datetime64(self.today - datetime.timedelta(days=1), 'D')
+        istart = 0
+        while istart < len(self.forecasts) and self.forecasts['date'][istart] == yesterday:
+            istart += 1
+        if debug and istart > 0:
+            print '    found yesterday in forecasts -- removing it'
+        self.forecasts = self.forecasts[istart:]
+
+        # then decide where we'll get today's forecast from: the forecasts if it's there...
+        is_today = self.forecasts['date'] == numpy.datetime64(self.today, 'D')
+        self.todays_forecast[self.forecasts['itod'][is_today]] = self.forecasts[is_today]
+        self.forecasts = self.forecasts[~is_today]  # NOTE remove today from <self.forecasts>
+        # ...otherwise from the history file
+        from_history = is_missing(self.todays_forecast) & ~is_missing(self.todays_history)
+        if debug:
+            print '    today from forecasts: %s   from history: %s' % (' '.join(utils.times_of_day[i] for i in numpy.flatnonzero(~is_missing(self.todays_forecast))),
+                                                                    ' '.join(utils.times_of_day[i] for i in numpy.flatnonzero(from_history)))
+        self.todays_forecast[from_history] = self.todays_history[from_history]
+
+        # and then add nonecasts for any missing tods at the end of the last day, so the forecasts divide evenly into days
+        if len(self.forecasts) > 0 and self.forecasts['itod'][-1] != len(utils.times_of_day) - 1:
             if debug:
-                print '    found yesterday in forecasts -- removing it'
-            self.forecasts = self.forecasts[1:]
-
-        # then decide where we'll get today's forecast from
-        # self.forecasts = self.forecasts[1:]  # uncomment to remove some of today from <self.forecasts>
-        for itod in range(len(utils.times_of_day)):
-            tod = utils.times_of_day[itod]
-            for itmp in range(len(utils.times_of_day)):  # see if it's in the forecast  (have to loop over the first three fcasts)
-                tmpfc = self.forecasts[itmp]
-                if tmpfc['date'] == self.today and tmpfc['time-of-day'] == tod:
-                    if debug:
-                        print '    found %s today in forecasts' % tod
-                    self.todays_forecast[itod] = self.forecasts.pop(itmp)  # NOTE remove this tod for today from <self.forecasts>
-                    break
-            if self.todays_forecast[itod][self.fcast_vals[0]] is None:  # arbitrarily use the first one to see if we found this <tod> in the forecasts
-                if debug:
-                    print '    couldn\'t find %s today in forecast, look in history' % tod
-                for itmp in range(len(utils.times_of_day)):  # see if it's in the forecast  (have to loop over the first three fcasts)
-                    tmpfc = self.todays_history[itmp]
-                    if tmpfc[self.fcast_vals[0]] is not None and tmpfc['date'] == self.today and tmpfc['time-of-day'] == tod:
-                        if debug:
-                            print '    found %s today in history' % tod
-                        self.todays_forecast[itod] = copy.deepcopy(tmpfc)
-                        break
-
-        # and then add any missing tods at the end of the forecasts
-        for idate in range(len(self.expected_forecast_dates)):
-            date = self.expected_forecast_dates[idate]
-            if date == self.today:  # already took today out of <self.forecasts>
-                continue
-            for tod in utils.times_of_day:
-                ifound = None
-                for ifc in range(len(self.todays_forecast)):
-                    fc = self.todays_forecast[ifc]
-                    if date == fc['date'] and tod == fc['time-of-day']:
-                        ifound = ifc
-                        break
-                if ifound is None:  # no forecast for this expected day
-                    if idate == len(self.expected_forecast_dates) - 1 and tod == 'night':  # ah, ok, it's just the last one
-                        if debug:
-                            print '    missing last tod %s for %s, adding nonecast' % (tod, date)
-                        self.add_empty_forecast(self.forecasts, date, tod)
-                else:
-                    if debug:
-                        print '    found %s for %s' % (tod, date)
-
-        # print 'HISTORY'
-        # for fc in self.history:
-        #     print '     ', fc['date'], '  ', fc['time-of-day'][0:2], '  ', fc['high']
-        # print 'TODAYS HISTORY'
-        # for fc in self.todays_history:
-        #     print '     ', fc['date'], '  ', fc['time-of-day'][0:2], '  ', fc['high']
-        # print 'TODAYS FORECAST'
-        # for fc in self.todays_forecast:
-        #     print '     ', fc['date'], '  ', fc['time-of-day'][0:2], '  ', fc['high']
-        # print 'forecasts'
-        # for fc in self.forecasts:
-        #     print '     ', fc['date'], '  ', fc['time-of-day'][0:2], '  ', fc['high']
+                print '    missing last tods for %s, adding nonecasts' % self.forecasts['date'][-1]
+            self.forecasts = numpy.concatenate([self.forecasts, make_slots([self.forecasts['date'][-1]], itods=range(self.forecasts['itod'][-1] + 1, len(utils.times_of_day)))])
 
     # ----------------------------------------------------------------------------------------
-    def write_history(self, history_fname):
-        if not os.path.exists(os.path.dirname(history_fname)):
-            os.makedirs(os.path.dirname(history_fname))
-
-        # rewrite the history file, including today's forecast (which may or may not have been read from the file initially)
-        with open(history_fname, 'w') as historyfile:
-            writer = csv.DictWriter(historyfile, self.history_header)
-            writer.writeheader()
-            for fcast in self.old_history + self.history + self.todays_forecast:  # NOTE each tod in <self.todays_forecast> is taken for <self.forecasts> if possible, otherwise it's from <self.todays_history>
-                if fcast[self.fcast_vals[0]] is None:  # don't write missing values
-                    continue
-                dcast = copy.deepcopy(fcast)
-                dcast['month'] = dcast['date'].month
-                dcast['day'] = dcast['date'].day
-                dcast['year'] = dcast['date'].year
-                del dcast['date']
-                writer.writerow(dcast)
+    def write_history(self, history, history_fname):
+        # save today's forecast (which may or may not have been read from the file initially), which <history> writes at the end of the run unless it's already there
+        slots = self.todays_forecast[~is_missing(self.todays_forecast)]  # NOTE each tod in <self.todays_forecast> is taken for <self.forecasts> if possible, otherwise it's from <self.todays_history>
+        for slot in slots.tolist():
+            line = dict(zip(slot_vars, slot[2:]))
+            line['month'] = slot[0].month
+            line['day'] = slot[0].day
+            line['year'] = slot[0].year
+            line['time-of-day'] = utils.times_of_day[slot[1]]
+            history.set(history_fname, self.history_header, line)
 
     # ----------------------------------------------------------------------------------------
-    def forecast(self, args, tree, filenamestr, location_name, location_title, elevation, history_dir, htmldir):
+    def forecast(self, args, tree, filenamestr, location_name, location_title, elevation, history, history_dir, htmldir):
         # print etree.tostring(tree.getroot(), pretty_print=True, method='html')
-        for tr in tree.findall('.//tr'):
-            keys = tr.keys()
-            thlist = tr.findall('th')
-            tdlist = tr.findall('td')
-            if 'class' in keys and tr.get('class') == 'lar hea ':
-                self.parse_days(tr)
-            elif 'class' in keys and tr.get('class') == 'lar hea1':  # am/pm header
-                self.parse_tods(tr)
-            elif len(thlist) > 0 and thlist[0].text.strip() == 'Wind':
-                self.parse_wind(tr)
-            elif len(thlist) > 0 and thlist[0].text.strip() == 'Snow (':
-                self.parse_simple('snow', tr, expected_units='cm')
-            elif len(thlist) > 0 and thlist[0].text.strip() == 'Rain (':
-                self.parse_simple('rain', tr, expected_units='mm')
-            elif len(thlist) > 0 and 'High' in thlist[0].text:
-                self.parse_simple('high', tr, expected_units='C')
-            elif len(thlist) > 0 and 'Low' in thlist[0].text:
-                self.parse_simple('low', tr, expected_units='C')
-            else:
-                pass
+        table = extract_forecast_table(tree)
+        self.parse_days(table['days'])
+        self.add_forecasts(table)
 
         # self.ascii(self.forecasts)
         history_fname = history_dir + '/' + filenamestr + '.csv'
-        self.read_history(history_fname)
+        self.read_history(history, history_fname)
         self.combine_history_and_forecasts()  # NOTE after this, today is neither in <self.history>, nor in the <self.forecasts>
-        self.write_history(history_fname)
+        self.write_history(history, history_fname)
         plotdir = htmldir + '/mtwx'
         if not os.path.exists(plotdir):
             os.makedirs(plotdir)
-        daily_forecasts = self.combine_all_times_of_day(self.forecasts)
-        daily_history = self.combine_all_times_of_day(self.history)
-        plotting.make_mtwx_plot(args, filenamestr, location_name, location_title, int(meters_to_feet(int(elevation))), plotdir, self.todays_forecast, self.forecasts, daily_history, daily_forecasts)
+        daily = combine_times_of_day(numpy.concatenate([self.history, self.forecasts]))  # both at once
+        n_history_days = len(self.history) // len(utils.times_of_day)
+        daily_history, daily_forecasts = to_dicts(daily[:n_history_days]), to_dicts(daily[n_history_days:])
+        plotting.make_mtwx_plot(args, filenamestr, location_name, location_title, int(meters_to_feet(int(elevation))), plotdir, to_dicts(self.todays_forecast), to_dicts(self.forecasts), daily_history, daily_forecasts)
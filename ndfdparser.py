@@ -3,156 +3,163 @@ import sys
 import os
 import datetime
 from collections import OrderedDict
-from subprocess import check_call, CalledProcessError
-import csv
+import numpy
+from xml.etree import ElementTree as ET
 
+import aggregation
 import oldplotting
 import plotting
 
 weekdays = ('Mon', 'Tues', 'Wed', 'Thurs', 'Fri', 'Sat', 'Sun')
 
 # ----------------------------------------------------------------------------------------
-def parse_noaa_time_string(noaa_time_str):
-    date_str, time_str = noaa_time_str.split('T')  # will raise ValueError if it doesn't split into two pieces
-    tzhackdelta = None
-    if '-' in time_str:
-        time_str, tzinfo_str = time_str.split('-')  # ignoring time zone info for now
-    elif time_str[-1] == 'Z':
-        print 'HACK subtracting eight hours from GMT'
-        tzhackdelta = datetime.timedelta(hours=-8)
-        time_str = time_str[:-1]
-    year, month, day = [ int(val) for val in date_str.split('-') ]
-    hour, minute, second = [ int(val) for val in time_str.split(':') ]
-    moment = datetime.datetime(year, month, day, hour, minute, second)
-    if tzhackdelta is not None:
-        moment += tzhackdelta
-    return moment
+decoded_times = {}  # tuple of time strings : (datetime64 array, list of datetimes), since the same layouts show up for every point (and in every batch)
+def decode_noaa_times(time_strs):
+    """
+    Convert the list of ndfd time strings <time_strs> all at once, returning (datetime64 array, list of datetimes).
+    Keeps local time and ignores the utc offset (numpy datetimes don't have time zones anyway), except for 'Z' (i.e. gmt) times, from which we subtract eight hours (a hack, since it's wrong half the year).
+    """
+    key = tuple(time_strs)
+    if key not in decoded_times:
+        moments = numpy.array([tstr[:19] for tstr in time_strs], dtype='datetime64[s]')  # 'YYYY-MM-DDTHH:MM:SS', i.e. without the offset
+        is_gmt = numpy.array([tstr.endswith('Z') for tstr in time_strs], dtype=bool)
+        if is_gmt.any():
+            print 'HACK subtracting eight hours from GMT for %d times' % numpy.count_nonzero(is_gmt)
+            moments[is_gmt] -= numpy.timedelta64(8, 'h')
+        decoded_times[key] = (moments, moments.tolist())
+    return decoded_times[key]
 
 # ----------------------------------------------------------------------------------------
-def get_time_layouts(root):
-    layouts = {}
-    for lout in root.find('data').findall('time-layout'):
-        name = lout.find('layout-key').text
-        layouts[name] = {'start':[], 'end':[]}
-        for start_end in ('start', 'end'):
-            for tmptime in lout.iter(start_end + '-valid-time'):
-                moment = parse_noaa_time_string(tmptime.text)
-                layouts[name][start_end].append(moment)
-    return layouts
+def get_time_layout(lout):
+    """
+    return (name, layout) for the <time-layout> element <lout>, where layout has lists of datetimes for 'start' and 'end', and the same thing as datetime64 arrays in 'start-array' and 'end-array'
+    NOTE the lists and arrays are shared with any other layout with the same times, so don't modify them
+    """
+    layout = {}
+    for start_end in ('start', 'end'):
+        layout[start_end + '-array'], layout[start_end] = decode_noaa_times([tmptime.text for tmptime in lout.iter(start_end + '-valid-time')])
+    return lout.find('layout-key').text, layout
 
 # ----------------------------------------------------------------------------------------
-def combine_days(action, pdata, debug=False):
-    """ 
-    Perform <action> for all the values within each day, where <action> is either sum or mean.
+def iterparse_points(source, n_points=None, debug=False):
     """
-    assert action == 'sum' or action == 'mean'
-
-    starts, ends, values, weight_sum = [], [], [], []
-
-    # ----------------------------------------------------------------------------------------
-    def get_time_delta_in_hours(start, end):
-        """ NOTE assumes no overflows or wraps or nothing """
-        dhour = end.hour - start.hour
-        dmin = end.minute - start.minute
-        dsec = end.second - start.second
-        dtime = datetime.timedelta(hours=dhour, minutes=dmin, seconds=dsec)  # NOTE rounds to nearest second
-        # print start, end, dtime
-        return float(dtime.seconds) / (60.*60.)
-    # ----------------------------------------------------------------------------------------
-    def add_new_day(dstart, dend, dval):
-        weight = '-'
-        starts.append(dstart)
-        ends.append(dend)
-        if action == 'sum':
-            values.append(dval)
-        elif action == 'mean':
-            weight = float(get_time_delta_in_hours(dstart, dend))
-            values.append(weight*dval)
-            weight_sum.append(weight)
-        else:
-            raise Exception('invalid action'+action)
-        if debug:
-            print '    new day', dstart, dend, weight, dval
-    # ----------------------------------------------------------------------------------------
-    def increment_day(dstart, dend, dval):
-        ends[-1] = dend
-        weight = '-'
-        if action == 'sum':
-            values[-1] += dval
-        elif action == 'mean':
-            weight = float(get_time_delta_in_hours(dstart, dend))
-            values[-1] += weight * dval
-            weight_sum[-1] += weight
-        else:
-            raise Exception('invalid action'+action)
-        if debug:
-            print '    increment', starts[-1], dend, weight, dval, '   ', values[-1]
-    # ----------------------------------------------------------------------------------------
-    def incorporate_value(istart, iend, ival):
-        # if debug:
-        #     print '    incorporate', istart, iend, ival
-        if len(values) == 0 or ends[-1].day != istart.day:
-            add_new_day(istart, iend, ival)
-        else:
-            increment_day(istart, iend, ival)
-
-    for ival in range(len(pdata['values'])):
-        start = pdata['time-layout']['start'][ival]
-        if len(pdata['time-layout']['end']) > 0:  # some of them only have start times
-            end = pdata['time-layout']['end'][ival]
-        elif len(pdata['time-layout']['start']) > ival+1:  # so use the next start time minus a ms if we can
-            end = pdata['time-layout']['start'][ival+1] - datetime.timedelta(milliseconds=-1)
-        else:
-            end = pdata['time-layout']['start'][ival] + datetime.timedelta(hours=6)  # otherwise just, hell, add six hours
-        if debug:
-            print ' day %3d-%-3d  hour %3d-%-3d     %s' % (start.day, end.day, start.hour, end.hour, pdata['values'][ival])
-
-        # skip null values (probably from cloud cover)
-        if pdata['values'][ival] == None:
-            if debug:
-                print '    skipping null value'
+    Stream through the dwml document in <source> (file name or file object), yielding (ipoint, point) for each location as soon as its <parameters> have been read.
+    <ipoint> is the location's index in the document (i.e. the order in which we asked for them), and <point> is a dict with 'lat', 'lon', 'more-info', and 'data' (as from parse_parameters()).
+    Each element is thrown away as soon as we've pulled out what we need, so memory doesn't grow with the number of points (or hours) in the document.
+    Locations with no data are yielded (with point None) at the end, and if there's no data at all (e.g. ndfd sent back an <error>), nothing is yielded.
+    If <n_points> is set, raises before yielding anything if the document doesn't have that many locations.
+    NOTE relies on dwml putting all the <location>s and <time-layout>s before the <parameters> that refer to them
+    """
+    locations = OrderedDict()  # location key : point info (without 'data')
+    location_indices = {}  # location key : index in <locations>
+    time_layouts = {}
+    finished = set()
+    data = None
+    depth = 0
+
+    def check_n_points():  # all the <location>s come first, so by the time we get to any <parameters> we know how many there are
+        if n_points is not None and len(locations) != n_points:
+            raise Exception('got %d points from ndfd, but asked for %d' % (len(locations), n_points))
+
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 2 and elem.tag == 'data':
+                data = elem
             continue
+        if depth == 3 and data is not None:  # immediate children of <data>
+            if elem.tag == 'location':
+                point = elem.find('point')
+                location_indices[elem.find('location-key').text] = len(locations)
+                locations[elem.find('location-key').text] = {'lat' : point.get('latitude') if point is not None else None,
+                                                             'lon' : point.get('longitude') if point is not None else None,
+                                                             'more-info' : None}
+            elif elem.tag == 'moreWeatherInformation':
+                if elem.get('applicable-location') in locations:
+                    locations[elem.get('applicable-location')]['more-info'] = elem.text
+            elif elem.tag == 'time-layout':
+                name, layout = get_time_layout(elem)
+                time_layouts[name] = layout
+            elif elem.tag == 'parameters':
+                key = elem.get('applicable-location')
+                if key not in locations:
+                    raise Exception('parameters for unknown location %s' % key)
+                if len(finished) == 0:
+                    check_n_points()
+                point = dict(locations[key])
+                point['data'] = parse_parameters(elem, time_layouts, debug=debug)
+                finished.add(key)
+                yield location_indices[key], point
+            data.remove(elem)
+        elif depth == 2 and elem.tag == 'head':
+            elem.clear()
+        depth -= 1
+
+    if len(finished) == 0 and len(locations) > 0:
+        check_n_points()
+    for ipoint, key in enumerate(locations):
+        if key not in finished:
+            yield ipoint, None
 
-        val = float(pdata['values'][ival])
-        if start.day == end.day:
-            incorporate_value(start, end, val)
-        else:
-            if debug:
-                print '       start (%s) and end (%s) days differ' % (start, end)
-            # print start, end
-            # assert start.day + 1 == end.day  # for now only handle the case where they differ by one day
-            midnight = datetime.datetime(year=end.year, month=end.month, day=end.day, hour=0, minute=0, second=0)
-            if action == 'sum':
-                hours_before = get_time_delta_in_hours(start, midnight)  #24 - start.hour
-                hours_after = get_time_delta_in_hours(midnight, end)  #end.hour
-                val_before = val * float(hours_before) / (hours_before + hours_after)
-                val_after = val * float(hours_after) / (hours_before + hours_after)
-                if debug:
-                    print '        apportioning between',
-                    print 'first %f * %f / (%f + %f) = %f' % (val, hours_before, hours_before, hours_after, val_before),
-                    print 'and second %f * %f / (%f + %f) = %f' % (val, hours_after, hours_before, hours_after, val_after)
-            else:
-                val_before, val_after = val, val
-            incorporate_value(start, midnight + datetime.timedelta(milliseconds=-1), val_before)  #start + datetime.timedelta(hours=24-start.hour, milliseconds=-1), val_before)
-            incorporate_value(midnight, end + datetime.timedelta(milliseconds=-1), val_after)  # end - datetime.timedelta(hours=end.hour), end, val_after)
-
-    dailyvals = {}
-    for ival in range(len(values)):
-        dailyvals[int(starts[ival].day)] = values[ival]
-        if action == 'mean':
-            # if debug:
-            #     print 'total', get_time_delta_in_hours(starts[ival], ends[ival])
-            dailyvals[int(starts[ival].day)] /= weight_sum[ival]  #get_time_delta_in_hours(starts[ival], ends[ival])
+# ----------------------------------------------------------------------------------------
+def get_interval_arrays(pdata):
+    """ return (starts, ends, values) arrays for <pdata>, for aggregation.aggregate_days() """
+    layout = pdata['time-layout']
+    n_values = len(pdata['values'])
+    starts = layout['start-array'][:n_values]
+    if len(layout['end-array']) > 0:
+        ends = layout['end-array'][:n_values]
+    else:  # some of them only have start times, so use the next start time, and for the last one just, hell, add six hours
+        next_starts = layout['start-array'][1 : n_values + 1]
+        ends = numpy.concatenate([next_starts, starts[len(next_starts):] + numpy.timedelta64(6, 'h')])
+    values = numpy.array([float(val) if val is not None else numpy.nan for val in pdata['values']])  # null values are probably from cloud cover
+    return starts, ends, values
 
-    if debug:
-        print '  final:'
-        for key in sorted(dailyvals.keys()):
-            print '    ', key, dailyvals[key]
-    return dailyvals
+# ----------------------------------------------------------------------------------------
+# each location's daily forecast lives in a numpy structured array, one row per day (starting with today), with nan for missing values -- it only gets turned into text when we write the html
+daily_vars = ['hi', 'lo', 'liquid', 'snow', 'wind', 'percent-precip', 'percent-cloud']  # snow is in inches, like everything else precip-related
+daily_dtype = numpy.dtype([('date', 'datetime64[D]')] + [(var, 'f8') for var in daily_vars])
+
+# ----------------------------------------------------------------------------------------
+def make_days(dates):
+    """ empty days (i.e. all values nan) for each date in <dates> """
+    days = numpy.zeros(len(dates), dtype=daily_dtype)
+    days['date'] = numpy.array(dates, dtype='datetime64[D]')
+    for var in daily_vars:
+        days[var] = numpy.nan
+    return days
 
 # ----------------------------------------------------------------------------------------
-def parse_data(root, time_layouts, debug=False):
-    pars = root.find('data').find('parameters')
+def get_value(day, var):
+    """ <var> for the single day <day> as a plain float, or None if it's missing """
+    value = day[var]
+    return None if numpy.isnan(value) else float(value)
+
+# ----------------------------------------------------------------------------------------
+def get_daily_forecast(data, ndays=5):
+    """ fill in the daily values we show for the <ndays> days starting with today, combining the values within each day for the ones that aren't already daily """
+    days = make_days([datetime.date.today() + datetime.timedelta(days=iday) for iday in range(ndays)])
+    series = [('liquid', 'sum', 'Liquid Precipitation Amount'),
+              ('snow', 'sum', 'Snow Amount'),
+              ('wind', 'mean', 'Wind Speed'),
+              ('percent-cloud', 'mean', 'Cloud Cover Amount'),
+              ('percent-precip', 'mean', '12 Hourly Probability of Precipitation')]
+    dates, table = aggregation.aggregate_days([(name, action) + get_interval_arrays(data[ndfd_name]) for name, action, ndfd_name in series])
+    _, idays, idates = numpy.intersect1d(days['date'], dates, return_indices=True)
+    for name, _, _ in series:
+        days[name][idays] = table[name][idates]
+
+    for iday, date in enumerate(days['date'].tolist()):
+        tmax = find_max_temp(data['Daily Maximum Temperature'], date)
+        tmin = find_min_temp(data['Daily Minimum Temperature'], date, date + datetime.timedelta(days=1))
+        days['hi'][iday] = tmax if tmax is not None else numpy.nan
+        days['lo'][iday] = tmin if tmin is not None else numpy.nan
+
+    return days
+
+# ----------------------------------------------------------------------------------------
+def parse_parameters(pars, time_layouts, debug=False):
+    """ pull the values for each variable out of the <parameters> element <pars> """
     data = {}
     for vardata in pars:
         # first figure out the name
@@ -161,7 +168,7 @@ def parse_data(root, time_layouts, debug=False):
             raise Exception('ERROR too many names for %s: %s' % (vardata.tag, ', '.join(all_names)))
         name = all_names[0].text
         if name in data:
-            raise Exception('ERROR %s already in data' % key)
+            raise Exception('ERROR %s already in data' % name)
 
         # then get the data
         data[name] = {}
@@ -182,84 +189,74 @@ def parse_data(root, time_layouts, debug=False):
                     print '  time layout different length for %s' % name
                 else:
                     pass
+            data[name]['index'] = index_series(data[name])
 
     return data
 
 # ----------------------------------------------------------------------------------------
-def find_min_temp(pdata, prev_day, next_day):
-    """ find min temp for the night of <prev_day> to <next_day> """
-    for ival in range(len(pdata['values'])):
-        start = pdata['time-layout']['start'][ival]
-        end = pdata['time-layout']['end'][ival]
-        if start.day == prev_day and end.day == next_day:
-            return int(pdata['values'][ival])
-    # raise Exception('ERROR didn\'t find min temp for night of %d-%d in %s' % (prev_day, next_day, pdata['time-layout']))
-    return None
+def index_series(pdata):
+    """
+    Index the values in <pdata> by calendar date, so the find_*() functions below don't have to scan the whole series for every day:
+      'day':       date : first value that starts and ends on that date (e.g. max temp)
+      'overnight': (start date, end date) : first value spanning those dates (e.g. min temp)
+      'hours':     date : list of (hour, value) for each value that starts on that date (e.g. icons)
+    """
+    index = {'day' : {}, 'overnight' : {}, 'hours' : {}}
+    starts, ends = pdata['time-layout']['start'], pdata['time-layout']['end']
+    for ival, value in enumerate(pdata['values']):
+        start = starts[ival]
+        index['hours'].setdefault(start.date(), []).append((start.hour, value))
+        if len(ends) == 0:  # some of them only have start times
+            continue
+        end = ends[ival]
+        if start.date() == end.date():
+            index['day'].setdefault(start.date(), value)
+        else:
+            index['overnight'].setdefault((start.date(), end.date()), value)
+    return index
 
 # ----------------------------------------------------------------------------------------
-def find_max_temp(pdata, day):
-    """ find min temp for the night of <prev_day> to <next_day> """
-    for ival in range(len(pdata['values'])):
-        start = pdata['time-layout']['start'][ival]
-        end = pdata['time-layout']['end'][ival]
-        if start.day == day and end.day == day:
-            return int(pdata['values'][ival])
-    # raise Exception('ERROR didn\'t find max temp for %d in %s' % (day, pdata['time-layout']))
-    return None
+def find_min_temp(pdata, prev_date, next_date):
+    """ find min temp for the night of <prev_date> to <next_date> """
+    value = pdata['index']['overnight'].get((prev_date, next_date))
+    return int(value) if value is not None else None
 
 # ----------------------------------------------------------------------------------------
-def find_icon_for_time(day, hour, icondata, debug=False):
-    if debug:
-        print 'look: %d %d' % (day, hour)
-    closest_icon_url = None  # url corresponding to nearest time
-    closest_hour = None
-    for i in range(len(icondata['time-layout']['start'])):
-        time = icondata['time-layout']['start'][i]
-        if debug:
-            print time
-        if time.day != day:  # not even the right day
-            continue
-        if closest_icon_url is None or abs(time.hour - hour) < abs(closest_hour - hour):
-            closest_icon_url = icondata['values'][i]
-            closest_hour = time.hour
-            clday = time.day
+def find_max_temp(pdata, date):
+    """ find max temp for <date> """
+    value = pdata['index']['day'].get(date)
+    return int(value) if value is not None else None
+
+# ----------------------------------------------------------------------------------------
+def find_icon_for_time(date, hour, icondata, debug=False):
+    """ url of the icon closest to <hour> on <date> (None if there aren't any that day) """
+    hourvals = icondata['index']['hours'].get(date)
+    if hourvals is None:  # not even the right day
+        return None
+    closest_hour, closest_icon_url = min(hourvals, key=lambda hv: abs(hv[0] - hour))  # min() takes the first one in case of a tie, i.e. the earlier one
     if debug:
-        print '  using %s at day %d hour %d' % (closest_icon_url, clday, closest_hour)
+        print '  using %s at %s hour %d' % (closest_icon_url, date, closest_hour)
     return closest_icon_url  # can be None
 
 # ----------------------------------------------------------------------------------------
-def get_history(history_fname):
+def get_history(store, history_fname):
+    """ the last few days from the historystore <store> """
     n_max_days = 6
 
-    if not os.path.exists(history_fname):
-        return None
-    fileinfo = OrderedDict()  # unsorted fileinfo
-    with open(history_fname, 'r') as historyfile:
-        reader = csv.DictReader(historyfile)
-        for line in reader:
-            key = datetime.datetime(int(line['year']), int(line['month']), int(line['day']))
-            now = datetime.datetime.now()
-            rounded_now = datetime.datetime(now.year, now.month, now.day)
-            if (key - rounded_now).days >= 0:  # entry is in the future (or is today)
-                continue
-            fileinfo[key] = line
-
-    # fileinfo = OrderedDict(sorted(fileinfo.iteritems(), key=lambda x: x[1]['month']))
-
     history = {'dates' : [], 'days' : [], 'hi' : [], 'lo' : [], 'liquid' : [], 'snow' : [], 'wind' : []}
     found_one_day = False
     for iday in range(n_max_days):
         day = datetime.datetime.now() - datetime.timedelta(n_max_days - iday)
         history['days'].append(day.day)
         history['dates'].append(datetime.date.today() - datetime.timedelta(n_max_days - iday))  # hacking this in now... should've used this from the start though
-        key = datetime.datetime(day.year, day.month, day.day)
-        if key in fileinfo:
+        line = store.get(history_fname, history['dates'][-1])
+        if line is not None:
             found_one_day = True
-            history['hi'].append(float(fileinfo[key]['hi']))
-            history['lo'].append(float(fileinfo[key]['lo']))
-            history['liquid'].append(float(fileinfo[key]['liquid']))
-            history['snow'].append(float(fileinfo[key]['snow']) / 12.)
-            history['wind'].append(float(fileinfo[key]['wind']))
+            history['hi'].append(float(line['hi']))
+            history['lo'].append(float(line['lo']))
+            history['liquid'].append(float(line['liquid']))
+            history['snow'].append(float(line['snow']) / 12.)
+            history['wind'].append(float(line['wind']))
         else:
             history['hi'].append(None)
             history['lo'].append(None)
@@ -272,87 +269,39 @@ def get_history(history_fname):
     return history
 
 # ----------------------------------------------------------------------------------------
-def get_todays_forecast_from_history(history_fname):
-    if not os.path.exists(history_fname):
-        return None
-    fileinfo = OrderedDict()
-    with open(history_fname, 'r') as historyfile:
-        reader = csv.DictReader(historyfile)
-        for line in reader:
-            key = datetime.datetime(int(line['year']), int(line['month']), int(line['day']))
-            date = datetime.date(int(line['year']), int(line['month']), int(line['day']))
-            if date != datetime.date.today():
-                continue
-            fileinfo[key] = line
-
-    if len(fileinfo) == 0:
-        return None
-
-    forecast = {'dates' : [], 'days' : [], 'hi' : [], 'lo' : [], 'liquid' : [], 'snow' : [], 'wind' : []}
+def get_todays_forecast_from_history(store, history_fname):
+    """ what we archived yesterday as the forecast for today, as a one-row daily array (or None if we didn't) """
     today = datetime.date.today()
-    forecast['days'].append(today.day)
-    forecast['dates'].append(today)
-    key = datetime.datetime(today.year, today.month, today.day)
-    if key in fileinfo:
-        found_one_day = True
-        forecast['hi'].append(float(fileinfo[key]['hi']))
-        forecast['lo'].append(float(fileinfo[key]['lo']))
-        forecast['liquid'].append(float(fileinfo[key]['liquid']))
-        forecast['snow'].append(float(fileinfo[key]['snow']) / 12.)
-        forecast['wind'].append(float(fileinfo[key]['wind']))
-    else:
-        forecast['hi'].append(None)
-        forecast['lo'].append(None)
-        forecast['liquid'].append(None)
-        forecast['snow'].append(None)
-        forecast['wind'].append(None)
-
+    line = store.get(history_fname, today)
+    if line is None:
+        return None
+    forecast = make_days([today])
+    for var in ['hi', 'lo', 'liquid', 'snow', 'wind']:
+        forecast[var] = float(line[var]) if line[var] not in ('', None) else numpy.nan
     return forecast
 
 # ----------------------------------------------------------------------------------------
-def write_tomorrows_history(history_fname, tomorrow, tmax, tmin, liquid, snow, wind):
-    rounded_tomorrow = datetime.datetime(tomorrow.year, tomorrow.month, tomorrow.day)  # no hours and minutes and whatnot
-
-    history = OrderedDict()
+def write_tomorrows_history(store, history_fname, tomorrow, tmax, tmin, liquid, snow, wind):
+    """ save tomorrow's forecast in the historystore <store> (which writes it at the end of the run, unless it hasn't changed since the last time) """
     history_header = ('month', 'day', 'year', 'hi', 'lo', 'liquid', 'snow', 'wind')
-    if os.path.exists(history_fname):  # read in any existing history
-        with open(history_fname, 'r') as historyfile:
-            reader = csv.DictReader(historyfile)
-            for line in reader:
-                key = datetime.datetime(int(line['year']), int(line['month']), int(line['day']))
-                history[key] = line
-
-    # tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
-    # if rounded_tomorrow in history:
-    #     print 'replacing'
-    history[rounded_tomorrow] = {'month' : tomorrow.month,
-                                 'day' : tomorrow.day,
-                                 'year' : tomorrow.year,
-                                 'hi' : tmax,
-                                 'lo' : tmin,
-                                 'liquid' : liquid,
-                                 'snow' : snow,
-                                 'wind' : wind}
-    with open(history_fname, 'w') as historyfile:
-        writer = csv.DictWriter(historyfile, history_header)
-        writer.writeheader()
-        for line in history.values():
-            writer.writerow(line)
+    store.set(history_fname, history_header, {'month' : tomorrow.month,
+                                              'day' : tomorrow.day,
+                                              'year' : tomorrow.year,
+                                              'hi' : tmax,
+                                              'lo' : tmin,
+                                              'liquid' : liquid,
+                                              'snow' : snow,
+                                              'wind' : wind})
 
 # ----------------------------------------------------------------------------------------
-def get_html(args, data, location_name, htmldir, ndays=5, debug=False):
-    liquid = combine_days('sum', data['Liquid Precipitation Amount'])
-    snow = combine_days('sum', data['Snow Amount'])
-    wind_speed = combine_days('mean', data['Wind Speed'])
-    cloud = combine_days('mean', data['Cloud Cover Amount'])
-    percent_precip = combine_days('mean', data['12 Hourly Probability of Precipitation'])
-
-    txtvals = {'dates':[], 'days':[], 'tmax':[], 'tmin':[], 'liquid':[], 'snow':[], 'wind':[], 'cloud':[], 'precip':[]}
+def get_html(args, days, data, location_name, htmldir, icons, history, debug=False):
+    """ html table rows for the daily forecast <days> (from get_daily_forecast()) """
     if debug:
         print '%-5s    %4s   %5s%5s   %5s  %5s' % ('', 'hi lo', 'total precip (in)    snow (in)', '%', 'wind', 'cloud')
     rowlist = []
 
-    history_data = get_history(args.history_dir + '/noaa/' + location_name + '.csv')
+    history_fname = args.history_dir + '/noaa/' + location_name + '.csv'
+    history_data = get_history(history, history_fname)
     history_plotname = oldplotting.make_noaa_history_plot(args, location_name, htmldir, history_data)
     if args.no_history:
         pass
@@ -360,31 +309,15 @@ def get_html(args, data, location_name, htmldir, ndays=5, debug=False):
         rowlist.append('n/a')
     else:
         rowlist.append('<a target="_blank" href="' + history_plotname + '"><img  src="' + history_plotname + '" alt="weather" width="120" height="75">')
-        
-    for iday in range(ndays):
-        day = datetime.datetime.now() + datetime.timedelta(days=iday)
-    
-        tmax = find_max_temp(data['Daily Maximum Temperature'], day.day)
-        tmin = find_min_temp(data['Daily Minimum Temperature'], day.day, (day + datetime.timedelta(days=1)).day)
+
+    for iday, day in enumerate(days):
+        date = day['date'].tolist()
+        tmax, tmin, liquid, snow, wind_speed, cloud, percent_precip = [get_value(day, var) for var in ('hi', 'lo', 'liquid', 'snow', 'wind', 'percent-cloud', 'percent-precip')]
 
         if iday == 1:  # tomorrow (i.e. the soonest complete day for which we have a forecast)
-            write_tomorrows_history(args.history_dir + '/noaa/' + location_name + '.csv', day, tmax, tmin, liquid.get(day.day, None), snow.get(day.day, None), wind_speed.get(day.day, None))
-
-        icon_url = find_icon_for_time(day.day, 12, data['Conditions Icons'])  # find icon for noon this day
-        icon_url = icon_url.replace('http://forecast.weather.gov/images/wtf', 'http://www.nws.noaa.gov/weather/images/fcicons')  # some of the images seem to not be at the orignal url, but if you google them...
-        if icon_url is not None:
-            icon_file = os.path.basename(icon_url)
-            if not os.path.exists(htmldir + '/images'):
-                os.makedirs(htmldir + '/images')
-            if not os.path.exists(htmldir + '/images/' + icon_file):
-                print 'downloading %s' % icon_url
-                try:
-                    check_call(['wget', '-q', '-O', htmldir + '/images/' + icon_file, icon_url])
-                except CalledProcessError:
-                    print 'ERROR ' + icon_file + ' not found at ' + icon_url
-                    
-        else:
-            icon_file = 'missing.jpg'
+            write_tomorrows_history(history, history_fname, date, int(tmax) if tmax is not None else None, int(tmin) if tmin is not None else None, liquid, snow, wind_speed)
+
+        icon_file = icons.add(find_icon_for_time(date, 12, data['Conditions Icons']))  # find icon for noon this day (downloaded later, along with everybody else's)
 
         row = ''
         if tmax is not None:
@@ -404,14 +337,14 @@ def get_html(args, data, location_name, htmldir, ndays=5, debug=False):
         row += '<br>'
 
         # precip
-        if day.day in percent_precip:
-            row += '<b> %.0f</b><font size=1>%%</font>' % percent_precip[day.day]
+        if percent_precip is not None:
+            row += '<b> %.0f</b><font size=1>%%</font>' % percent_precip
 
         # liquid
         row += '<font color=#1947D1><b>'
-        if day.day in liquid:
-            if liquid[day.day] > 0.0:
-                row += ('&nbsp%.2f"' % liquid[day.day]).replace('0.', '.')
+        if liquid is not None:
+            if liquid > 0.0:
+                row += ('&nbsp%.2f"' % liquid).replace('0.', '.')
             else:
                 row += '&nbsp0"'
         else:
@@ -420,9 +353,9 @@ def get_html(args, data, location_name, htmldir, ndays=5, debug=False):
 
         # snow
         row += '<font color=grey size=1><b>'
-        if day.day in liquid:
-            if snow[day.day] > 0.0:
-                row += (' (<b>%.0f"</b>)' % snow[day.day]).replace('0.', '.')
+        if liquid is not None:
+            if snow is not None and snow > 0.0:
+                row += (' (<b>%.0f"</b>)' % snow).replace('0.', '.')
             else:
                 row += ''
         else:
@@ -432,110 +365,44 @@ def get_html(args, data, location_name, htmldir, ndays=5, debug=False):
         row += '<br>'
 
         # wind speed
-        if day.day in wind_speed:
-            row += '<b>%.0f</b>' % wind_speed[day.day]
+        if wind_speed is not None:
+            row += '<b>%.0f</b>' % wind_speed
             row += '<font size=1>mph    </font>'
         else:
             row += ' - '
-        
+
         # cloud cover
-        if day.day in cloud:
-            row += '&nbsp<b>%.0f</b>' % cloud[day.day]
+        if cloud is not None:
+            row += '&nbsp<b>%.0f</b>' % cloud
             row += '<font size=1>%cloud</font>'
         else:
             row += '&nbsp&nbsp&nbsp- '
-        
+
         rowlist.append(row)
 
-        tv = txtvals
-        tv['tmax'].append('-' if tmax is None else tmax)
-        tv['tmin'].append('-' if tmin is None else tmin)
-        tv['liquid'].append(('%5.1f' % liquid[day.day]) if day.day in liquid else '-')
-        tv['snow'].append('')
-        if day.day in snow and snow[day.day] > 0.0:
-            tv['snow'][-1] = '%5.1f' % snow[day.day]
-        tv['wind'].append(('%5.0f' % wind_speed[day.day]) if day.day in wind_speed else '-')
-        tv['cloud'].append(('%5.0f' % cloud[day.day]) if day.day in cloud else '-')
-        tv['precip'].append(('%5.0f' % percent_precip[day.day]) if day.day in percent_precip else '-')
-        tv['days'].append(weekdays[day.weekday()])
-        tv['dates'].append(datetime.date.today() + datetime.timedelta(days=iday))
         if debug:
-            print '%-6s %4s %-3s     %5s            %5s     %5s   %5s  %5s' % (weekdays[day.weekday()], tv['tmax'][-1], tv['tmin'][-1], tv['liquid'][-1], tv['snow'][-1], tv['precip'][-1], tv['wind'][-1], tv['cloud'][-1])
-
-    return tv, rowlist, history_data
+            def fmt(value, format_str):
+                return format_str % value if value is not None else '-'
+            print '%-6s %4s %-3s     %5s            %5s     %5s   %5s  %5s' % (weekdays[date.weekday()], fmt(tmax, '%d'), fmt(tmin, '%d'), fmt(liquid, '%5.1f'), fmt(snow, '%5.1f'), fmt(percent_precip, '%5.0f'), fmt(wind_speed, '%5.0f'), fmt(cloud, '%5.0f'))
 
-# ----------------------------------------------------------------------------------------
-def convert_crap(var, vals):
-    tvnames = ['tmin', 'tmax', 'liquid', 'wind', 'snow', 'precip', 'cloud']
-    good_names = ['lo', 'hi', 'liquid', 'wind', 'snow', 'percent-precip', 'percent-cloud']
-    if var in tvnames:
-        good_name = good_names[tvnames.index(var)]
-        good_vals = [float(val) if val != '-' and val != '' else None for val in vals]
-        if var == 'snow':  # convert to feet
-            good_vals = [val / 12. if val is not None else None for val in good_vals]
-    elif var == 'dates':
-        good_name = var
-        good_vals = [val for val in vals]
-    else:  # var == 'cloud':
-        good_name, good_vals = None, None
-
-    return good_name, good_vals
+    return rowlist, history_data
 
 # ----------------------------------------------------------------------------------------
-def combine_data_for_plotting(history_data, tv, todays_history):
-    # for k, v in tv.items():
-    #     print '%20s   %s' % (k, v)
+def forecast(args, point, location_name, elevation, htmldir, icons, history):
+    """ <point> is from iterparse_points() """
+    days = get_daily_forecast(point['data'])
+    rowlist, history_data = get_html(args, days, point['data'], location_name, htmldir, icons, history, debug=False)
+    rowlist.insert(0, 'LOCATION <font size="2"><a href="' + point['more-info'] + '">noaa</a></font>')
 
     # make sure we get today from only one place
-    today = datetime.date.today()
-    if tv['tmax'][0] == '-':  # it's late in the day, so they don't give us a high temp any more
+    plotdays = days
+    if numpy.isnan(days['hi'][0]):  # it's late in the day, so they don't give us a high temp any more
         print 'getting today from history file'
-        assert today == tv['dates'][0]
-        for var in tv:
-            del tv[var][0]
+        todays_history = get_todays_forecast_from_history(history, args.history_dir + '/noaa/' + location_name + '.csv')
         assert todays_history is not None
-        todays_forecast = todays_history
+        plotdays = numpy.concatenate([todays_history, days[1:]])
     else:
         print 'getting today from current forecast'
-        assert today == tv['dates'][0]
-        todays_forecast = {}
-        for var in tv:
-            name, vals = convert_crap(var, [tv[var][0], ])
-            todays_forecast[name] = vals
-            del tv[var][0]
-
-    # for k, v in tv.items():
-    #     print '%20s   %s' % (k, v)
-
-    forecasts = {}
-    for var in tv:
-        name, vals = convert_crap(var, tv[var])
-        if name is not None and vals is not None:
-            forecasts[name] = vals
+    combined_plotname = plotting.make_combined_noaa_plot(args, location_name, elevation, htmldir, history_data, plotdays)
 
-    # for k, v in todays_forecast.items():
-    #     print '%20s   %s' % (k, v)
-    # for k, v in forecasts.items():
-    #     print '%20s   %s' % (k, v)
-
-    return todays_forecast, forecasts
-
-# ----------------------------------------------------------------------------------------
-def forecast(args, tree, location_name, elevation, htmldir):
-    root = tree.getroot()
-    time_layouts = get_time_layouts(root)
-    data = parse_data(root, time_layouts)
-    point = root.find('data').find('location').find('point')
-    lat, lon = point.get('latitude'), point.get('longitude')
-    tv, rowlist, history_data = get_html(args, data, location_name, htmldir, debug=False)
-    point_forecast_url = list(root.iter('moreWeatherInformation'))[0].text
-    rowlist.insert(0, 'LOCATION <font size="2"><a href="' + point_forecast_url + '">noaa</a></font>')
-
-    # for k, v in history_data.items():
-    #     print '%20s   %s' % (k, v)
-    # print '---'
-    todays_history = get_todays_forecast_from_history(args.history_dir + '/noaa/' + location_name + '.csv')
-    todays_forecast, forecasts = combine_data_for_plotting(history_data, tv, todays_history)
-    combined_plotname = plotting.make_combined_noaa_plot(args, location_name, elevation, htmldir, history_data, todays_forecast, forecasts)
-
-    return tv['days'], rowlist
+    return [weekdays[date.weekday()] for date in days['date'].tolist()], rowlist
@@ -38,7 +38,8 @@ def make_wind_plot(axwind, combined_forecasts, fake_date_range, total_width, tot
     axwind.text(-.03, -.3, 'mph', color=wind_color, fontsize=20)
 
 # ----------------------------------------------------------------------------------------
-def make_combined_noaa_plot(args, location_name, elevation, htmldir, history, todays_forecast, forecasts):
+def make_combined_noaa_plot(args, location_name, elevation, htmldir, history, days):
+    """ <days> is the daily forecast array from ndfdparser (today first), and <history> the dict of lists from ndfdparser.get_history() """
     if not os.path.exists(htmldir + '/noaa'):
         os.makedirs(htmldir + '/noaa')
 
@@ -78,15 +79,12 @@ def make_combined_noaa_plot(args, location_name, elevation, htmldir, history, to
     hi_color = 'red'
     # plt.locator_params(nbins=nxbins, axis='x')
     # plt.locator_params(nbins=nybins, axis='y')
-    combined_forecasts = {}
-    for var in todays_forecast:
-        if var is None:  # not sure what this is doing in there
-            continue
-        if var == 'days' or var == 'percent-cloud' or var == 'percent-precip':
-            continue
-        combined_forecasts[var] = todays_forecast[var] + forecasts[var]
-        if history is not None:
-            combined_forecasts[var] = history[var] + combined_forecasts[var]
+    plotvars = ['hi', 'lo', 'liquid', 'snow', 'wind']
+    combined_forecasts = {var : [] if history is None else list(history[var]) for var in ['dates'] + plotvars}
+    combined_forecasts['dates'] += days['date'].tolist()
+    for var in plotvars:
+        scale = 1. / 12 if var == 'snow' else 1.  # history snow is already in feet
+        combined_forecasts[var] += [None if numpy.isnan(val) else scale * val for val in days[var].tolist()]
 
     ax2 = ax1.twinx()
     liquid_color = '#1947D1'
@@ -195,12 +193,12 @@ def make_combined_noaa_plot(args, location_name, elevation, htmldir, history, to
     # ax1.plot([-0.2, len(fake_date_range) / 4.], [32., 32.], color='blue', linestyle='--', linewidth=1)
     # ax1.plot([3./4 * len(fake_date_range), len(fake_date_range)], [32., 32.], color='blue', linestyle='--', linewidth=1)
 
-    for iday in range(len(forecasts['dates'])):
-        if forecasts['liquid'][iday] is None:
-            history_len = 0 if history is None else len(history['dates'])
-            xpos = float(iday + history_len + 1) / len(combined_forecasts['dates']) - 0.03
-            fig.text(xpos, 0.21, '%.0f%% precip' % forecasts['percent-precip'][iday], color='blue', fontsize=20, alpha=0.5)
-            fig.text(xpos, 0.15, '%.0f%% cloud' % forecasts['percent-cloud'][iday], color='black', fontsize=20, alpha=0.5)
+    history_len = 0 if history is None else len(history['dates'])
+    for iday in range(1, len(days)):  # not today
+        if numpy.isnan(days['liquid'][iday]):
+            xpos = float(iday + history_len) / len(combined_forecasts['dates']) - 0.03
+            fig.text(xpos, 0.21, '%.0f%% precip' % days['percent-precip'][iday], color='blue', fontsize=20, alpha=0.5)
+            fig.text(xpos, 0.15, '%.0f%% cloud' % days['percent-cloud'][iday], color='black', fontsize=20, alpha=0.5)
 
     ax1.spines['top'].set_visible(False)
     ax1.get_xaxis().tick_bottom()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# stand-in for the sites we scrape, serving the bundled fixtures (shifted to look like they were fetched today) so scrape.py and wrfparser can be run, and timed, without touching the network
+# point them at it with --replay-url http://localhost:<port>
+# requests look like the original url with the host moved into the path, e.g. http://localhost:8000/www.weather.gov/forecasts/xml/...
+import os
+import io
+import re
+import copy
+import time
+import zlib
+import random
+import datetime
+import argparse
+import threading
+import email.utils
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.etree import ElementTree as ET
+
+repodir = os.path.dirname(os.path.realpath(__file__))
+ndfd_fixture_date = datetime.date(2015, 11, 13)  # creation date of noaa-test.xml
+mtwx_fixture_days = [('Monday', 7), ('Tuesday', 8), ('Wednesday', 9), ('Thursday', 10), ('Friday', 11), ('Saturday', 12)]  # day headers in mtwx-test.html
+wrf_image_size = (1000, 1000)  # has to be big enough for wrfparser's crop boxes
+
+# ----------------------------------------------------------------------------------------
+def shift_ndfd_dates(xmlstr, today):
+    """ move every date in <xmlstr> forward so the forecast starts <today> """
+    delta = today - ndfd_fixture_date
+    def shift(match):
+        return (datetime.date(*[int(g) for g in match.groups()]) + delta).strftime('%Y-%m-%d') + 'T'
+    return re.sub(r'(\d{4})-(\d\d)-(\d\d)T', shift, xmlstr)
+
+# ----------------------------------------------------------------------------------------
+def make_multipoint(xmlstr, n_points):
+    """ copy the one point in <xmlstr> to make the response to a listLatLon request for <n_points> points """
+    root = ET.fromstring(xmlstr)
+    data = root.find('data')
+    for tag in ['location', 'moreWeatherInformation', 'parameters']:  # same order as the real thing: all the locations, then all the links, ..., then all the parameters
+        original = data.find(tag)
+        for ipoint in range(n_points, 1, -1):  # insert each one right after the original, so go backwards
+            element = copy.deepcopy(original)
+            if tag == 'location':
+                element.find('location-key').text = 'point' + str(ipoint)
+            else:
+                element.set('applicable-location', 'point' + str(ipoint))
+            data.insert(list(data).index(original) + 1, element)
+    return ET.tostring(root)
+
+# ----------------------------------------------------------------------------------------
+def shift_mtwx_days(htmlstr, today):
+    """ rename the day headers in <htmlstr> so the first column is yesterday (mountain-forecast starts partway through the previous day) """
+    day_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+    first = today - datetime.timedelta(days=1)
+    for iday, (old_name, old_number) in enumerate(mtwx_fixture_days):
+        date = first + datetime.timedelta(days=iday)
+        htmlstr = htmlstr.replace('<b>%s</b> %d\n' % (old_name, old_number), '<b>@@%s</b> %d\n' % (day_names[date.weekday()], date.day))  # mark them so we don't rename one twice
+    return htmlstr.replace('@@', '')
+
+# ----------------------------------------------------------------------------------------
+def make_wrf_image():
+    from PIL import Image, ImageDraw  # only needed for this, and only under python 3
+    image = Image.new('P', wrf_image_size, color=0)
+    image.putpalette([255, 255, 255, 0, 0, 0, 60, 120, 220] + [0, 0, 0] * 253)
+    draw = ImageDraw.Draw(image)
+    for ibox in range(10):
+        draw.rectangle([100 * ibox, 100 * ibox, 100 * ibox + 150, 100 * ibox + 150], fill=2, outline=1)
+    outbuf = io.BytesIO()
+    image.save(outbuf, format='GIF')
+    return outbuf.getvalue()
+
+# ----------------------------------------------------------------------------------------
+def make_status_page(today, progress=None):
+    """ wrf run status page, either complete or (if <progress> is set) running through forecast hour <progress> """
+    status_time = datetime.datetime.combine(today, datetime.time(9, 30))
+    status_line = 'STATUS of %s12 UW runs as of %d:%02d %s PDT %s %d' % ((today - datetime.timedelta(days=1)).strftime('%Y%m%d'), status_time.hour % 12 or 12, status_time.minute,
+                                                                        'am' if status_time.hour < 12 else 'pm', status_time.strftime('%b'), status_time.day)
+    status = 'complete' if progress is None else '4km to hour %d, 1 1/3km to hr %d' % (progress, progress)
+    return ('<html><body><table><tr><td>%s</td><td>%s</td></tr></table></body></html>' % (status_line, status)).encode()
+
+# ----------------------------------------------------------------------------------------
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real servers
+
+    def do_GET(self):
+        replay = self.server
+        with replay.lock:
+            replay.n_requests += 1
+        time.sleep(replay.latency + random.uniform(0, replay.jitter))
+        if random.random() < replay.error_rate:
+            self.send_body(replay.error_code, b'injected error')
+            return
+
+        host, _, path = self.path.lstrip('/').partition('/')
+        path, _, query = ('/' + path).partition('?')
+        if host.endswith('weather.gov') and path.startswith('/forecasts/xml/'):
+            latlons = parse_qs(query).get('listLatLon')
+            n_points = len(latlons[0].split()) if latlons is not None else 1
+            body = replay.ndfd if n_points == 1 else make_multipoint(replay.ndfd, n_points)
+        elif host.endswith('mountain-forecast.com') and path.startswith('/peaks/'):
+            body = replay.mtwx
+        elif path.endswith('/run_status.html'):
+            body = make_status_page(replay.today, replay.wrf_progress)
+        elif path.endswith('.gif'):
+            match = re.search(r'\.([0-9]+)\.0000\.gif$', path)
+            if replay.wrf_progress is not None and match is not None and int(match.group(1)) >= replay.wrf_progress:
+                self.send_body(404, b'not written yet')  # the model hasn't gotten there
+                return
+            body = replay.wrf_image
+        elif path.endswith('.jpg') or path.endswith('.png'):
+            body = replay.wrf_image  # condition icons: doesn't matter what it looks like
+        else:
+            self.send_body(404, b'no fixture for ' + self.path.encode())
+            return
+
+        etag = '"%08x"' % zlib.crc32(body)
+        if self.headers.get('If-None-Match') == etag or self.headers.get('If-Modified-Since') == replay.last_modified:
+            self.send_body(304, b'')
+            return
+        self.send_body(200, body, {'ETag' : etag, 'Last-Modified' : replay.last_modified})
+
+    def send_body(self, code, body, headers=None):
+        self.send_response(code)
+        for key, val in (headers or {}).items():
+            self.send_header(key, val)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if code != 304:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+# ----------------------------------------------------------------------------------------
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency=0., jitter=0., error_rate=0., error_code=503, wrf_progress=None, verbose=False):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', port), ReplayHandler)
+        self.latency, self.jitter = latency, jitter  # seconds before each response (plus a random amount up to <jitter>)
+        self.error_rate, self.error_code = error_rate, error_code  # fraction of requests that get <error_code> instead of an answer
+        self.wrf_progress = wrf_progress  # if set, pretend the wrf run is still going, and has only gotten this far
+        self.verbose = verbose
+        self.today = datetime.date.today()
+        self.last_modified = email.utils.formatdate(time.time(), usegmt=True)
+        with open(repodir + '/noaa-test.xml') as xmlfile:
+            self.ndfd = shift_ndfd_dates(xmlfile.read(), self.today).encode()
+        with open(repodir + '/mtwx-test.html') as htmlfile:
+            self.mtwx = shift_mtwx_days(htmlfile.read(), self.today).encode()
+        self.wrf_image = make_wrf_image()
+        self.n_requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def start(self):
+        """ serve in a background thread (for use from benchmark.py) """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+# ----------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0., help='seconds to wait before answering each request')
+    parser.add_argument('--jitter', type=float, default=0., help='add a random delay of up to this many seconds to each request')
+    parser.add_argument('--error-rate', type=float, default=0., help='fraction of requests to answer with --error-code')
+    parser.add_argument('--error-code', type=int, default=503)
+    parser.add_argument('--wrf-progress', type=int, help='pretend the wrf run is still going, and has only written the hours before this one')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    server = ReplayServer(port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, error_code=args.error_code, wrf_progress=args.wrf_progress, verbose=args.verbose)
+    print('replaying at %s' % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
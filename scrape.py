@@ -3,16 +3,22 @@ import csv
 import argparse
 import os
 import datetime
-from xml.etree import ElementTree as ET
 from collections import OrderedDict
 from lxml import etree
 import urllib
 import sys
+import io
 
 import HTML
+import fetcher
+import httpcache
+import httpclient
+import iconmanager
 import ndfdparser
 import mtwxparser
 import htmlinfo
+import historydb
+import historystore
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--location-fname', default='all-locations.csv')
@@ -20,11 +26,24 @@ parser.add_argument('--noaa-location-fname', default='locations/noaa.csv')
 parser.add_argument('--mtwx-location-fname', default='locations/mtwx.csv')
 parser.add_argument('--outfname', required=True)
 parser.add_argument('--history-dir', default='_history')
+parser.add_argument('--history-db', help='keep history in this sqlite file instead of in csvs in --history-dir (use historydb.py to move existing csvs into it)')
 parser.add_argument('--cachedir', default='_cache')
 parser.add_argument('--no-history', action='store_true', help='Don\'t add a column with history plot (still caches current forecast even if true)')
 parser.add_argument('--old-style', action='store_true')
-parser.add_argument('--use-cache', action='store_true', help='read from cached html/xml files')
+parser.add_argument('--use-cache', action='store_true', help='read from cached html/xml files no matter how old they are (i.e. don\'t touch the network)')
+parser.add_argument('--mtwx-stream-parse', action='store_true', help='parse mountain-forecast pages with mtwxparser.parse_forecast_rows(), which keeps only the forecast rows (a bit slower than building the whole page, but caps memory if pages get huge)')
+parser.add_argument('--mtwx-cache-ttl', type=float, default=1., help='hours for which a cached mountain-forecast page is used without asking the server whether it\'s changed')
+parser.add_argument('--n-tries', type=int, default=httpclient.n_tries, help='number of times to try each request before giving up (and falling back to the cached copy, if there is one)')
+parser.add_argument('--timeout', type=float, default=httpclient.default_timeout[1], help='seconds to wait for each read before giving up on an attempt (the connect timeout stays at %.0fs)' % httpclient.default_timeout[0])
+parser.add_argument('--ndfd-batch-size', type=int, default=1, help='number of locations to ask for in each ndfd request (1 means one request per location, 0 means all of them in one request)')
+parser.add_argument('--noaa-cache-ttl', type=float, default=3., help='same as --mtwx-cache-ttl, but for ndfd (which only updates a few times a day)')
+parser.add_argument('--mtwx-max-connections', type=int, default=4, help='max simultaneous connections to mountain-forecast.com')
+parser.add_argument('--noaa-max-connections', type=int, default=4, help='max simultaneous connections to weather.gov')
+parser.add_argument('--replay-url', help='send all requests to this replay server (see replayserver.py) instead of the real sites')
 args = parser.parse_args()
+httpclient.n_tries = args.n_tries
+httpclient.replay_url = args.replay_url
+historydb.dbfname = args.history_db
 
 if not os.path.exists(os.path.dirname(args.outfname)):
     os.makedirs(os.path.dirname(args.outfname))
@@ -43,26 +62,12 @@ def get_wrf_links(location):
     return 'http://www.atmos.washington.edu/mm5rt/rt/load.cgi?latest+YYYYMMDDHH/images_d4/' + location + '.mg.gif+text+4/3%20km'
 
 # ----------------------------------------------------------------------------------------
-def get_mtwx(args, location_name, location_title, elevation, num_days=6, metric=False):
-    filenamestr = location_name + '-' + str(elevation)
-    url = get_mtwx_link(location_name, elevation)
-    parser = etree.HTMLParser()
-
-    cachefname = args.cachedir + '/mtwx/' + filenamestr + '.html'
-    if args.use_cache:
-        tree = etree.parse(cachefname, parser)
-    else:
-        tree = etree.parse(url, parser)
-        tmpstr = etree.tostring(tree.getroot(), pretty_print=True, method='html')
-        with open(cachefname, 'w') as tmpfile:
-            tmpfile.write(tmpstr)
-
-    mtp = mtwxparser.mtwxparser(num_days = num_days)
-    forecast = mtp.forecast(args, tree, filenamestr, location_name, location_title, elevation, history_dir=args.history_dir + '/mtwx', htmldir=os.path.dirname(os.path.abspath(args.outfname)))
-
-# ----------------------------------------------------------------------------------------
-def get_noaa_forecast(args, location_name, elevation, lat, lon, start_date=datetime.date.today(), num_days=6, metric=False):
-    location_info = [('lat', lat), ('lon', lon)]
+def get_ndfd_url(latlons, start_date=datetime.date.today(), num_days=6, metric=False):
+    """ url for the ndfd forecast at each (lat, lon) in <latlons> """
+    if len(latlons) == 1:
+        location_info = [('lat', latlons[0][0]), ('lon', latlons[0][1])]
+    else:  # each point gets its own <location> and <parameters> in the response
+        location_info = [('listLatLon', ' '.join(str(lat) + ',' + str(lon) for lat, lon in latlons))]
     params = location_info + [("format", "24 hourly"),
                               ("startDate", start_date.strftime("%Y-%m-%d")),
                               ("numDays", str(num_days)),
@@ -73,24 +78,68 @@ def get_noaa_forecast(args, location_name, elevation, lat, lon, start_date=datet
                            "/sample_products/browser_interface"
                            "/ndfd" + client_type + ".php")
     
-    url = "?".join([FORECAST_BY_DAY_URL, query_string])
+    return "?".join([FORECAST_BY_DAY_URL, query_string])
 
-    cachefname = args.cachedir + '/noaa/' + location_name + '.xml'
-    if args.use_cache:
-        tree = ET.parse(cachefname)
+# ----------------------------------------------------------------------------------------
+def get_mtwx_cachefname(args, location_name, elevation):
+    return args.cachedir + '/mtwx/' + location_name + '-' + str(elevation) + '.html'
+def get_noaa_cachefname(args, location_name):
+    return args.cachedir + '/noaa/' + location_name + '.xml'
+def get_noaa_batch_cachefname(args, ibatch):
+    return args.cachedir + '/noaa/batch-' + str(ibatch) + '.xml'
+
+# ----------------------------------------------------------------------------------------
+def get_mtwx(args, payload, location_name, location_title, elevation, history, num_days=6, metric=False):
+    filenamestr = location_name + '-' + str(elevation)
+    if args.mtwx_stream_parse:
+        tree = mtwxparser.parse_forecast_rows(payload)
     else:
-        resp = urllib.urlopen(url)
-        tree = ET.parse(resp)
-        xmlstr = ET.tostring(tree.getroot())
-        with open(cachefname, 'w') as tmpfile:
-            tmpfile.write(xmlstr)
-        if 'No data were found using the following input:' in xmlstr:
-            print '    No data found for %s' % location_name
-            return None
+        parser = etree.HTMLParser()
+        tree = etree.fromstring(payload, parser).getroottree()
 
-    forecast = ndfdparser.forecast(args, tree, location_name, elevation, htmldir=os.path.dirname(os.path.abspath(args.outfname)))
+    mtp = mtwxparser.mtwxparser(num_days = num_days)
+    forecast = mtp.forecast(args, tree, filenamestr, location_name, location_title, elevation, history, history_dir=args.history_dir + '/mtwx', htmldir=os.path.dirname(os.path.abspath(args.outfname)))
+
+# ----------------------------------------------------------------------------------------
+def get_noaa_points(payload, location_names):
+    """ yield (name, point) for each of <location_names> as soon as it's been parsed (see ndfdparser.iterparse_points()), where point is None if ndfd had no data for it """
+    n_points = 0
+    for ipoint, point in ndfdparser.iterparse_points(io.BytesIO(payload), n_points=len(location_names)):  # checks the number of points before yielding any of them
+        n_points += 1
+        yield location_names[ipoint], point
+    if n_points == 0:  # e.g. 'No data were found using the following input:'
+        print '    No data found for %s' % ', '.join(location_names)
+        for name in location_names:
+            yield name, None
+
+# ----------------------------------------------------------------------------------------
+def get_noaa_forecast(args, point, location_name, elevation, icons, history):
+    forecast = ndfdparser.forecast(args, point, location_name, elevation, htmldir=os.path.dirname(os.path.abspath(args.outfname)), icons=icons, history=history)
     return forecast
 
+# ----------------------------------------------------------------------------------------
+def fetch_payloads(args, jobs):
+    """ yield (key, payload, status, error) for each job in <jobs>, in the order in which they arrive (see fetcher.fetch_all()) """
+    if args.use_cache:
+        for job in jobs:
+            payload, _ = httpcache.read_cache(job['cachefname'])
+            yield job['key'], payload, None, (None if payload is not None else IOError('%s not in cache' % job['cachefname']))
+        return
+
+    max_connections = {httpclient.get_host(get_mtwx_link('', '')) : args.mtwx_max_connections,
+                       httpclient.get_host(get_ndfd_url([(0, 0)])) : args.noaa_max_connections}
+    for key, payload, status, error in fetcher.fetch_all(jobs, max_connections=max_connections, timeout=(httpclient.default_timeout[0], args.timeout)):
+        yield key, payload, status, error
+
+# ----------------------------------------------------------------------------------------
+def already_processed(status, plotfname):
+    """ if the payload hasn't changed and we already made today's plot from it, there's no need to parse it again """
+    if status not in ('fresh', 'not-modified', 'stale'):
+        return False
+    if not os.path.exists(plotfname):
+        return False
+    return datetime.date.fromtimestamp(os.path.getmtime(plotfname)) == datetime.date.today()  # the history part of the plot changes every day
+
 # ----------------------------------------------------------------------------------------
 # read config csvs
 mtwx_locations = OrderedDict()
@@ -197,34 +246,75 @@ newhtmlfile.close()
 # sys.exit()        
 
 # ----------------------------------------------------------------------------------------
-# get mtwx forecasts
+# fetch all the forecasts at once, and process each one as soon as it arrives
+jobs = []
 for name, line in mtwx_locations.items():
-    print '\n%s:' % line['name']
-    get_mtwx(args, line['name'], line['title'], line['elevation'])
-# sys.exit()
-# ----------------------------------------------------------------------------------------
-# and then noaa forecasts
-rows = []
+    jobs.append({'key' : ('mtwx', name),
+                 'url' : get_mtwx_link(line['name'], line['elevation']),
+                 'cachefname' : get_mtwx_cachefname(args, line['name'], line['elevation']),
+                 'ttl' : 3600 * args.mtwx_cache_ttl})
+noaa_names = list(noaa_locations.keys())
+batch_size = args.ndfd_batch_size if args.ndfd_batch_size > 0 else len(noaa_names)
+for ibatch, istart in enumerate(range(0, len(noaa_names), batch_size)):
+    names = tuple(noaa_names[istart : istart + batch_size])
+    jobs.append({'key' : ('noaa', names),
+                 'url' : get_ndfd_url([(noaa_locations[name]['lat'], noaa_locations[name]['lon']) for name in names]),
+                 'cachefname' : get_noaa_cachefname(args, names[0]) if len(names) == 1 else get_noaa_batch_cachefname(args, ibatch),
+                 'ttl' : 3600 * args.noaa_cache_ttl})
+htmldir = os.path.dirname(os.path.abspath(args.outfname))
+icons = iconmanager.iconmanager(htmldir + '/images', args.cachedir + '/icons.json')
+history = historystore.historystore()
+
+noaa_rows = {}
 fails = []
+days = []
 print 'TODO remove all the cruft from the old style plots'
-for name, line in noaa_locations.items():
-    print '\n%s:' % line['name']
-    args.location = ()  # TODO not sure why I do this
-    n_tries = 0
-    # while n_tries < 3:
-    days, forecast = get_noaa_forecast(args, line['name'], float(line['elevation']), line['lat'], line['lon'])
-    try:
-        # days, forecast = get_noaa_forecast(args, line['name'], float(line['elevation']), line['lat'], line['lon'])
-        extrastr = line['name'] + '<br>'
-        extrastr += '<font size="2">' + line['elevation'] + ' ft <br></font>'
-        if line['mtwx-location'] != '':
-            extrastr += '<font size="2"><a href="' + get_mtwx_link(line['mtwx-location'], line['mtwx-elevation']) + '">mtfcast</a></font>'
-        forecast[0] = forecast[0].replace('LOCATION', extrastr)
-        rows.append(forecast)
-        # break
-    except AttributeError:
-        fails.append(line['name'])
-    n_tries += 1
+try:
+    for (ltype, name), payload, status, error in fetch_payloads(args, jobs):
+        if ltype == 'mtwx':
+            line = mtwx_locations[name]
+            print '\n%s:' % line['name']
+            if error is not None:
+                print '    failed retrieving mtwx forecast: %s' % error
+                continue
+            if status == 'stale':
+                print '    couldn\'t get a new forecast, using cached copy'
+            if already_processed(status, htmldir + '/mtwx/' + line['name'] + '-' + str(line['elevation']) + '.svg'):
+                print '    unchanged since last run'
+                continue
+            get_mtwx(args, payload, line['name'], line['title'], line['elevation'], history)
+        elif ltype == 'noaa':
+            names = name  # one or more locations in each ndfd request
+            if error is not None:
+                print '\n%s:\n    failed retrieving noaa forecast: %s' % (', '.join(names), error)
+                fails += names
+                continue
+            if status == 'stale':
+                print '\n%s:\n    couldn\'t get a new forecast, using cached copy' % ', '.join(names)
+            for name, point in get_noaa_points(payload, names):
+                line = noaa_locations[name]
+                print '\n%s:' % line['name']
+                if point is None:
+                    fails.append(line['name'])
+                    continue
+                if not args.old_style and already_processed(status, htmldir + '/noaa/' + line['name'] + '.svg'):  # old style needs the table rows, so has to reparse
+                    print '    unchanged since last run'
+                    continue
+                args.location = ()  # TODO not sure why I do this
+                days, forecast = get_noaa_forecast(args, point, line['name'], float(line['elevation']), icons, history)
+                extrastr = line['name'] + '<br>'
+                extrastr += '<font size="2">' + line['elevation'] + ' ft <br></font>'
+                if line['mtwx-location'] != '':
+                    extrastr += '<font size="2"><a href="' + get_mtwx_link(line['mtwx-location'], line['mtwx-elevation']) + '">mtfcast</a></font>'
+                forecast[0] = forecast[0].replace('LOCATION', extrastr)
+                noaa_rows[name] = forecast
+        else:
+            raise Exception('bad ltype %s' % ltype)
+finally:  # write whatever history we got, even if some location blew up partway through the loop (it's the only copy of past forecasts)
+    history.flush()
+rows = [noaa_rows[name] for name in noaa_locations if name in noaa_rows]  # keep the order from the config file
+if not args.use_cache:
+    icons.download_missing()
 
 if not args.old_style:
     sys.exit()
@@ -1,27 +1,145 @@
 #!/usr/bin/env python
+# sort history csvs by date and time of day (see historylog.get_sort_key()), keeping only the latest (by default) row for each, i.e. compacting them (see historylog.py), without ever holding more than --max-rows of a file in memory
+# files that are already sorted (checked in one streaming pass) are left alone, e.g.:
+#   ./sort-csvs.py _history/noaa _history/mtwx --policy last-wins --n-procs 4
+import os
 import csv
 import sys
 import glob
-import datetime
-
-dirname = '/home/dralph/Dropbox/tmp/weatherscraper/history/noaa'
-
-for fname in glob.glob(dirname + '/*.csv'):
-    print fname
-    dates = []
-    ininfo = {}
-    with open(fname) as infile:
-        reader = csv.DictReader(infile)
-        for line in reader:
-            date = datetime.date(int(line['year']), int(line['month']), int(line['day']))
-            ininfo[date] = line
-            dates.append(date)
-            # if len(dates) > 10:
-            #     break
-    dates.sort()
-    with open(fname, 'w') as outfile:
-        writer = csv.DictWriter(outfile, reader.fieldnames)
-        writer.writeheader()
-        for date in dates:
-            writer.writerow(ininfo[date])
-    # sys.exit()
+import heapq
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+
+import historylog
+
+# ----------------------------------------------------------------------------------------
+def iter_keyed_lines(fname):
+    """ yield (sort key, raw line) for each row in <fname> (after the header), where the sort key is (iso date, time of day index or -1, line number) """
+    with open(fname, 'rb') as infile:
+        header = next(csv.reader([infile.readline()]))
+        for iline, line in enumerate(iter(infile.readline, b'')):
+            if line.strip() == b'':
+                continue
+            if not line.endswith(b'\n'):  # last line of a file that someone edited by hand
+                line += b'\r\n'
+            row = dict(zip(header, next(csv.reader([line]))))
+            date, itod = historylog.get_sort_key(row)
+            yield (date.isoformat(), itod, iline), line
+
+# ----------------------------------------------------------------------------------------
+def check_sorted(fname):
+    """ streaming pass through <fname>, returning (number of rows, number of rows out of order, number of rows with the same date and time of day as the previous one -- we only find all the duplicates once it's sorted) """
+    n_rows, n_unsorted, n_duplicates = 0, 0, 0
+    previous = None
+    for key, _ in iter_keyed_lines(fname):
+        n_rows += 1
+        if previous is not None:
+            if key[:2] < previous[:2]:
+                n_unsorted += 1
+            elif key[:2] == previous[:2]:
+                n_duplicates += 1
+        previous = key
+    return n_rows, n_unsorted, n_duplicates
+
+# ----------------------------------------------------------------------------------------
+def write_runs(fname, tmpdir, max_rows):
+    """ split <fname> into sorted runs of at most <max_rows> rows each in <tmpdir>, returning their file names """
+    run_fnames = []
+    def flush(chunk):
+        chunk.sort()
+        run_fnames.append('%s/run-%d' % (tmpdir, len(run_fnames)))
+        with open(run_fnames[-1], 'wb') as runfile:
+            for (datestr, itod, iline), line in chunk:
+                runfile.write(b'%s,%d,%d,%s' % (datestr, itod, iline, line))
+    chunk = []
+    for keyed_line in iter_keyed_lines(fname):
+        chunk.append(keyed_line)
+        if len(chunk) >= max_rows:
+            flush(chunk)
+            chunk = []
+    if len(chunk) > 0:
+        flush(chunk)
+    return run_fnames
+
+# ----------------------------------------------------------------------------------------
+def iter_run(run_fname):
+    with open(run_fname, 'rb') as runfile:
+        for runline in runfile:
+            datestr, itod, iline, line = runline.split(b',', 3)
+            yield (datestr, int(itod), int(iline)), line
+
+# ----------------------------------------------------------------------------------------
+def merge_runs(run_fnames, outfname, header_line, policy):
+    """ merge the sorted runs into <outfname>, keeping only the first or last (according to <policy>) row for each date and time of day, and returning the number of rows written """
+    runfiles = [iter_run(run_fname) for run_fname in run_fnames]
+    n_written = 0
+    with open(outfname, 'wb') as outfile:
+        outfile.write(header_line)
+        group = []  # rows with the same date and time of day, in the order they were in the original file
+        for key, line in heapq.merge(*runfiles):
+            if len(group) > 0 and key[:2] != group[-1][0][:2]:
+                outfile.write(group[0 if policy == 'first-wins' else -1][1])
+                n_written += 1
+                group = []
+            group.append((key, line))
+        if len(group) > 0:
+            outfile.write(group[0 if policy == 'first-wins' else -1][1])
+            n_written += 1
+    return n_written
+
+# ----------------------------------------------------------------------------------------
+def process_file(fname, policy='last-wins', max_rows=100000, check_only=False):
+    """ sort and dedupe <fname> if it needs it, returning a line describing what we did """
+    n_rows, n_unsorted, n_duplicates = check_sorted(fname)
+    if n_unsorted == 0 and n_duplicates == 0:
+        return '%s: %d rows, already sorted' % (fname, n_rows)
+    if check_only:
+        return '%s: %d rows, %d out of order, %d adjacent duplicates' % (fname, n_rows, n_unsorted, n_duplicates)
+
+    with open(fname, 'rb') as infile:
+        header_line = infile.readline()
+    tmpdir = tempfile.mkdtemp(prefix='.sort-', dir=os.path.dirname(os.path.abspath(fname)))  # same filesystem, so we can rename the result over the original
+    try:
+        run_fnames = write_runs(fname, tmpdir, max_rows)
+        n_written = merge_runs(run_fnames, tmpdir + '/sorted.csv', header_line, policy)
+        os.rename(tmpdir + '/sorted.csv', fname)
+    finally:
+        shutil.rmtree(tmpdir)
+    historylog.build_index(fname)
+    return '%s: %d rows, %d out of order, %d adjacent duplicates --> wrote %d rows (merged %d runs)' % (fname, n_rows, n_unsorted, n_duplicates, n_written, len(run_fnames))
+
+# ----------------------------------------------------------------------------------------
+def process_file_star(fargs):
+    return process_file(*fargs)
+
+# ----------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='history csvs, or directories of them')
+    parser.add_argument('--policy', choices=['last-wins', 'first-wins'], default='last-wins', help='which row to keep when several have the same date (and time of day): last-wins is the same as what historylog.py does when reading')
+    parser.add_argument('--max-rows', type=int, default=100000, help='max rows of a file to hold in memory at once (bigger files get sorted in runs of this size, which are then merged)')
+    parser.add_argument('--n-procs', type=int, default=1, help='number of files to process at once')
+    parser.add_argument('--check', action='store_true', help='only report which files need sorting, and exit with nonzero status if any do')
+    args = parser.parse_args()
+
+    fnames = []
+    for path in args.paths:
+        fnames += sorted(glob.glob(path + '/*.csv')) if os.path.isdir(path) else [path]
+    jobs = [(fname, args.policy, args.max_rows, args.check) for fname in fnames]
+    if args.n_procs > 1:
+        pool = multiprocessing.Pool(args.n_procs)
+        results = pool.imap_unordered(process_file_star, jobs)
+    else:
+        results = (process_file_star(job) for job in jobs)
+    n_unsorted = 0
+    for result in results:
+        print(result)
+        if not result.endswith('already sorted'):
+            n_unsorted += 1
+    if args.n_procs > 1:
+        pool.close()
+        pool.join()
+    if args.check and n_unsorted > 0:
+        sys.exit(1)
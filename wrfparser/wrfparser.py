@@ -9,7 +9,6 @@ import sys
 import glob
 from subprocess import check_call, CalledProcessError
 from lxml import etree
-import urllib.request, urllib.parse, urllib.error
 import datetime
 import calendar
 import pytesseract  # have to do both: pip --user pytesseract and sudo apt-get install tesseract-ocr
@@ -17,15 +16,24 @@ import argparse
 import colored_traceback.always
 import traceback
 from dateutil import tz
-import tempfile
 from collections import OrderedDict
 import traceback
 import ssl
+import requests
+import concurrent.futures
+import threading
+import json
+import email.utils
+import re
 
 ssl._create_default_https_context = ssl._create_unverified_context
 
 front_page_url = 'https://atmos.washington.edu/wrfrt/data/run_status.html'
 wrfdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(1, os.path.dirname(wrfdir))
+import httpclient
+httpclient.session.verify = False  # same as the ssl hack above
+requests.packages.urllib3.disable_warnings()
 dummy_image_path = wrfdir + '/woot.png'
 model_strings = ['WRF-GFS'] #, 'Extended WRF-GFS']
 
@@ -280,25 +288,152 @@ def get_fname(domain, maptype, variable, hour, processed=False):
     return outpath
 
 # ----------------------------------------------------------------------------------------
-def download_image(domain, maptype, variable, hour):
-    outfname = args.outdir + '/' + get_fname(domain, maptype, variable, hour)
+def get_manifest_fname():
+    return args.outdir + '/' + base_outdir + '/manifest.json'
+
+manifest = {}  # relative gif path : {'init-time' : init time of the run it came from (if we know it), 'last-modified' : http Last-Modified}
+manifest_lock = threading.Lock()
+# ----------------------------------------------------------------------------------------
+def read_manifest():
+    manifest.clear()
+    if os.path.exists(get_manifest_fname()):
+        with open(get_manifest_fname()) as manifestfile:
+            manifest.update(json.load(manifestfile))
+
+# ----------------------------------------------------------------------------------------
+def write_manifest():
+    if not os.path.exists(os.path.dirname(get_manifest_fname())):
+        os.makedirs(os.path.dirname(get_manifest_fname()))
+    with open(get_manifest_fname(), 'w') as manifestfile:
+        json.dump(manifest, manifestfile, sort_keys=True, indent=1)
+
+# ----------------------------------------------------------------------------------------
+def download_image(domain, maptype, variable, hour, init_time=None):
+    """ make sure we have the image from the run that started at <init_time> (if we don't know <init_time>, ask the server if it's changed since we last got it), returning True if it worked """
+    relfname = get_fname(domain, maptype, variable, hour)
+    outfname = args.outdir + '/' + relfname
     if args.no_download:
         print('    --no-download: doing nothing')
-        return
+        return False
     if not os.path.exists(os.path.dirname(outfname)):
         os.makedirs(os.path.dirname(outfname))
+
+    info = manifest.get(relfname)
+    headers = {}
+    if os.path.exists(outfname) and info is not None:
+        if init_time is not None and info['init-time'] == init_time:
+            return True  # already have it
+        if init_time is None and info['last-modified'] is not None:
+            headers['If-Modified-Since'] = info['last-modified']
+
     url = get_url(domain, maptype, variable, hour)
     try:
-        urllib.request.urlretrieve(url, outfname)
+        resp = httpclient.download(url, outfname, headers=headers)
         # check_call(['wget', '-O', outfname, url])
-    except CalledProcessError:
-        print('  failed retrieving %s' % url)
-        os.remove(outfname)
+    except requests.RequestException as e:
+        print('  failed retrieving %s (%s)' % (url, e))
+        return False
+    if resp.status_code == 304:
+        return True
+    with manifest_lock:
+        manifest[relfname] = {'init-time' : init_time, 'last-modified' : resp.headers.get('Last-Modified')}
+    return True
 
 # ----------------------------------------------------------------------------------------
-def download_all_images(domain, maptype, variable):
-    for hour in expected_hours[domain][variable]:
-        download_image(domain, maptype, variable, hour)
+def get_run_init_time():
+    """ init time (as a YYYYMMDDHH string) of the most recent run from the status page, or None if we can't figure it out """
+    parser = etree.HTMLParser()
+    try:
+        resp = httpclient.get(front_page_url)
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        print('    %s' % e)
+        return None
+    tree = etree.fromstring(resp.content, parser).getroottree()
+    for td in tree.findall('.//td'):
+        if td.text is None or 'STATUS' not in td.text:
+            continue
+        try:
+            run_time, _ = get_run_status_times(td)
+        except Exception as e:  # they change the format every so often
+            print('    couldn\'t get run time from status line: %s' % e)
+            return None
+        return run_time.strftime('%Y%m%d%H')
+    return None
+
+# ----------------------------------------------------------------------------------------
+def get_last_modified_time(info):
+    if info is None or info['last-modified'] is None:
+        return None
+    return email.utils.parsedate_to_datetime(info['last-modified'])
+
+# ----------------------------------------------------------------------------------------
+def remove_stale_images(download_list):
+    """ remove any images that are from an earlier run than the rest of their series, so we never show a mix of two runs """
+    series = OrderedDict()
+    for work in download_list:
+        if os.path.exists(args.outdir + '/' + get_fname(*work)):
+            series.setdefault(work[:3], []).append(work)
+
+    for works in series.values():
+        infos = [manifest.get(get_fname(*work)) for work in works]
+        init_times = [info['init-time'] if info is not None else None for info in infos]
+        if None not in init_times:
+            newest = max(init_times)
+            stale = [work for work, itime in zip(works, init_times) if itime != newest]
+        else:  # fall back to Last-Modified: frames from one run get written within a few hours of each other, whereas runs are twelve hours apart
+            lm_times = [get_last_modified_time(info) for info in infos]
+            if None in lm_times:
+                continue  # can't tell
+            newest = max(lm_times)
+            stale = [work for work, lmtime in zip(works, lm_times) if newest - lmtime > datetime.timedelta(hours=max_hours_within_run)]
+        for work in stale:
+            print('  removing %s from an earlier run' % get_fname(*work))
+            for processed in (False, True):
+                if os.path.exists(args.outdir + '/' + get_fname(*work, processed=processed)):
+                    os.remove(args.outdir + '/' + get_fname(*work, processed=processed))
+            with manifest_lock:
+                manifest.pop(get_fname(*work), None)
+            failed_downloads.add(work)  # don't want to just download the same old one again
+
+# ----------------------------------------------------------------------------------------
+def get_download_list(stuff_to_run):
+    """ (domain, maptype, variable, hour) for every image we need for all the lines in the config file """
+    download_list = []
+    for line in stuff_to_run:
+        for hour in expected_hours[line['domain']][line['variable']]:
+            work = (line['domain'], line['maptype'], line['variable'], hour)
+            if work not in download_list:
+                download_list.append(work)
+    return download_list
+
+failed_downloads = set()  # so we don't try them again one by one in get_fcast_image_info()
+unavailable_images = set()  # ones that the model hasn't gotten to yet (when streaming)
+max_hours_within_run = 6  # if we don't know init times, assume frames with Last-Modified times further apart than this are from different runs
+# ----------------------------------------------------------------------------------------
+def download_all_images(download_list):
+    failed_downloads.clear()
+    init_time = get_run_init_time()
+    print('downloading %d images with %d connections (init time %s)' % (len(download_list), args.max_connections, init_time if init_time is not None else 'unknown'))
+    start = time.time()
+    n_done = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_connections) as executor:
+        futures = {executor.submit(download_image, *work, init_time=init_time) : work for work in download_list}
+        for future in concurrent.futures.as_completed(futures):
+            n_done += 1
+            if not future.result():
+                failed_downloads.add(futures[future])
+            if n_done % 50 == 0 or n_done == len(download_list):
+                print('  %d / %d done (%d failed) in %.0fs' % (n_done, len(download_list), len(failed_downloads), time.time() - start))
+    if len(failed_downloads) > 0:
+        print('  failed downloading %d images: %s' % (len(failed_downloads), ' '.join(get_fname(*work) for work in sorted(failed_downloads))))
+
+# ----------------------------------------------------------------------------------------
+def is_available(domain, hour, progress):
+    """ has the model finished writing <hour> for <domain>? (<progress> is None if the run is complete) """
+    if progress is None:
+        return True
+    return domain in progress and hour < progress[domain]  # NOTE not <=, in case they're still writing the last one
 
 # ----------------------------------------------------------------------------------------
 def join_image_pieces(subimages, maptype):
@@ -364,7 +499,7 @@ def set_dates(imgfo):
     init_time = None
     for iimg in range(len(imgfo)):
         if init_time is None:
-            init_time = get_single_date(imgfo[iimg]['subimages']['init-time'], imgfo[iimg]['fname'])
+            init_time = get_single_date(get_init_time_subimage(imgfo[iimg]), imgfo[iimg]['fname'])
             break
     if init_time is None:  # couldn't get it from any of the images
         init_time = datetime.datetime.now() - datetime.timedelta(hours=typical_hours_between_init_and_zero_fcast_hour)
@@ -378,22 +513,42 @@ def set_dates(imgfo):
 def dummy_image():
     return Image.new("RGB", (10, 10))
 
+# ----------------------------------------------------------------------------------------
+def open_gif(fname):
+    try:
+        return Image.open(fname)  # model snow is giving me invalid gifs... then again it's late july, so maybe that's on purpose
+    except IOError as e:
+        print('    %s' % e)
+        return Image.open(dummy_image_path)
+
+# ----------------------------------------------------------------------------------------
+def get_init_time_subimage(info):
+    """ the part of the image with the init time, which we only crop out here if get_fcast_image_info() didn't already """
+    if info['subimages'] is not None:
+        return info['subimages']['init-time']
+    return get_subimage(open_gif(info['gif-fname']), 'init-time', get_margins(info['maptype']))
+
 # ----------------------------------------------------------------------------------------
 def get_fcast_image_info(domain, maptype, variable, hour):
     fname = args.outdir + '/' + get_fname(domain, maptype, variable, hour)
     if os.path.exists(fname):
         pass
         # print '  already exists: %s' % fname
+    elif (domain, maptype, variable, hour) in failed_downloads or (domain, maptype, variable, hour) in unavailable_images:
+        pass
     else:
         print('  downloading %s' % fname)
         download_image(domain, maptype, variable, hour)
+    processed_fname = args.outdir + '/' + get_fname(domain, maptype, variable, hour, processed=True)
+    if not os.path.exists(os.path.dirname(processed_fname)):
+        os.makedirs(os.path.dirname(processed_fname))
+    info = {'fcast-hour' : hour, 'fname' : processed_fname, 'gif-fname' : fname, 'maptype' : maptype, 'subimages' : None}
+    if os.path.exists(fname) and os.path.exists(processed_fname) and os.path.getmtime(processed_fname) >= os.path.getmtime(fname):
+        return info  # gif hasn't changed since we last processed it, so don't even open it (set_dates() crops out the init time if it needs it)
+
     margins = get_margins(maptype)
     if os.path.exists(fname):
-        try:
-            img = Image.open(fname)  # model snow is giving me invalid gifs... then again it's late july, so maybe that's on purpose
-        except IOError as e:
-            print('    %s' % e)
-            img = Image.open(dummy_image_path)
+        img = open_gif(fname)
         subimages = {sname : get_subimage(img, sname, margins) for sname in margins}
         final_image = join_image_pieces(subimages, maptype)
     else:
@@ -410,12 +565,9 @@ def get_fcast_image_info(domain, maptype, variable, hour):
     #     subimages['howe-to-chehalis'].save('tmp.png')
     #     sys.exit()
 
-    processed_fname = args.outdir + '/' + get_fname(domain, maptype, variable, hour, processed=True)
-    if not os.path.exists(os.path.dirname(processed_fname)):
-        os.makedirs(os.path.dirname(processed_fname))
     final_image.save(processed_fname)
-
-    return {'fcast-hour' : hour, 'fname' : processed_fname, 'subimages' : subimages}
+    info['subimages'] = subimages
+    return info
 
 # ----------------------------------------------------------------------------------------
 def join_fcasts(domain, maptype, variable):
@@ -600,6 +752,21 @@ def get_run_status_times(td):
 
     return run_time, status_time
 
+progress_domains = {'1 1/3km' : '1.33km', '4/3km' : '1.33km', '4km' : '4km', '12km' : '12km', '36/12km' : '12km'}  # what they call our domains on the status page
+run_progress = {}  # domain : hour through which the running model has gotten (empty if it's complete, or we couldn't tell)
+# ----------------------------------------------------------------------------------------
+def parse_progress(st_text):
+    """ e.g. '4km to hour 60, 1 1/3km to hr 24' """
+    progress = {}
+    for dstr, hour in re.findall(r'((?:1 1/3|[0-9/]+)km) to (?:hour|hr) ([0-9]+)', st_text):
+        if dstr in progress_domains:
+            progress[progress_domains[dstr]] = int(hour)
+    if len(progress) == 0:  # no domain, so assume it applies to all of them
+        match = re.search(r'to (?:hour|hr) ([0-9]+)', st_text)
+        if match is not None:
+            progress = {domain : int(match.group(1)) for domain in domain_codes}
+    return progress
+
 # ----------------------------------------------------------------------------------------
 def get_status(modeltype, cachefname=None, debug=False):
     # note: you really don't want to download images while the fcasts are running, since they go through their file system gradually replacing files as they run (i.e. you'll download an inconsistent series of images)
@@ -607,15 +774,15 @@ def get_status(modeltype, cachefname=None, debug=False):
 
     # cachefname = '/home/dralph/weatherscraper/wrfparser/_cache/WRF-GFS-2017-09-09_11:33:03.973294-status.html'
     # tree = etree.parse(cachefname, parser)
-    with tempfile.NamedTemporaryFile() as tmpfile:
-        if debug:
-            print('    retrieving %s' % front_page_url)
-        try:
-            urllib.request.urlretrieve(front_page_url, tmpfile.name)
-        except IOError as e:
-            print('    %s' % e)
-            return 'unknown'
-        tree = etree.parse(tmpfile, parser)
+    if debug:
+        print('    retrieving %s' % front_page_url)
+    try:
+        resp = httpclient.get(front_page_url)
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        print('    %s' % e)
+        return 'unknown'
+    tree = etree.fromstring(resp.content, parser).getroottree()
     if cachefname is not None:  # write html to a file in case we want it later
         if debug:
             print('    writing html to %s' % cachefname)
@@ -628,10 +795,12 @@ def get_status(modeltype, cachefname=None, debug=False):
 # they changed the format, so hacking this on
     assert len(tdlist) == 2
     st_text = tdlist[1].text
+    run_progress.clear()
     if st_text in ['complete', 'running']:
         return st_text
     elif 'to hour' in st_text or '1 1/3km to hr' in st_text:
         print('  status: %s' % st_text)
+        run_progress.update(parse_progress(st_text))
         return 'running'
     print('  unknown status: \'%s\'' % st_text)
     return 'unknown'
@@ -686,17 +855,24 @@ def check_all_models_complete(debug=False):
     return True
 
 # ----------------------------------------------------------------------------------------
-def run():
+def run(progress=None):
+    """ if <progress> is set, the model is still running, so only get the hours it's finished """
     stuff_to_run = []
     with open(args.config_fname) as cfgfile:
         reader = csv.DictReader(row for row in cfgfile if not row.startswith('#'))
         for line in reader:
             stuff_to_run.append(line)
 
+    download_list = get_download_list(stuff_to_run)
+    unavailable_images.clear()
+    unavailable_images.update(work for work in download_list if not is_available(work[0], work[3], progress))
+    if not args.no_download:  # if the images aren't there I think it will still try to download them one by one
+        read_manifest()
+        download_all_images([work for work in download_list if work not in unavailable_images])
+        remove_stale_images(download_list)  # includes ones we didn't download, i.e. from the previous run
+        write_manifest()
     for line in stuff_to_run:
         print(line['domain'], line['variable'])
-        if not args.no_download:  # if the images aren't there I think it will still try to download them one by one
-            download_all_images(line['domain'], line['maptype'], line['variable'])
         write_html(line['domain'], line['maptype'], line['variable'])
 
     htmlfnames = [get_htmlfname(line['domain'], line['variable']) for line in stuff_to_run]
@@ -713,9 +889,15 @@ parser.add_argument('--test', action='store_true')
 parser.add_argument('--no-sleep', action='store_true')
 parser.add_argument('--no-download', action='store_true')
 parser.add_argument('--no-push', action='store_true')
+parser.add_argument('--stream', action='store_true', help='while the model is running, process each forecast hour as soon as it\'s been written, rather than waiting for the whole run to finish')
+parser.add_argument('--max-connections', type=int, default=httpclient.default_pool_size, help='number of images to download at once (and connections to keep open to the wrf server)')
+parser.add_argument('--replay-url', help='send all requests to this replay server (see replayserver.py) instead of the real sites')
 args = parser.parse_args()
+httpclient.replay_url = args.replay_url
+httpclient.set_pool_size(httpclient.get_host(httpclient.rewrite_url(base_url)), args.max_connections)  # i.e. the replay server, if there is one
 
 running_sleep_time = 1800  # 1800s = 30m
+streaming_sleep_time = 600  # check more often if we're processing hours as they come in
 just_finished_sleep_time = 21600  # 21600s is 6h
 if args.test:
     args.no_sleep = True
@@ -725,8 +907,19 @@ if args.test:
 while True:
     all_complete = check_all_models_complete(debug=True)
     while not args.no_sleep and not all_complete:
-        print('  %s: forecasts are running, sleep for %d min' % (datetime.datetime.now().strftime('%a %B %d %H:%M'), int(running_sleep_time / 60.)))
-        time.sleep(running_sleep_time)
+        sleep_time = running_sleep_time
+        if args.stream and len(run_progress) > 0:
+            print('  %s: forecasts are running, processing the hours that are done (%s)' % (datetime.datetime.now().strftime('%a %B %d %H:%M'), ', '.join('%s: %d' % (d, h) for d, h in sorted(run_progress.items()))))
+            try:
+                run(progress=dict(run_progress))
+                if not args.no_push:
+                    check_call([wrfdir + '/upload.sh', args.outdir.replace('/wrfparser', '')])
+            except:
+                print(''.join(traceback.format_exception(*sys.exc_info())))
+                print('      failed to run (see above), continuing')
+            sleep_time = streaming_sleep_time
+        print('  %s: forecasts are running, sleep for %d min' % (datetime.datetime.now().strftime('%a %B %d %H:%M'), int(sleep_time / 60.)))
+        time.sleep(sleep_time)
         all_complete = check_all_models_complete(debug=True)
 
     try: